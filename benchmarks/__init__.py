@@ -0,0 +1,4 @@
+"""
+Benchmarks for the VCF conversion hot loops. Run from the repository root with:
+    python -m benchmarks.run_benchmarks --rows 200000 --output results.json
+"""
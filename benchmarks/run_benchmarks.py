@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from benchmarks.synthetic_vcf import write_synthetic_vcf, INFO_TYPES
+from vcf_header import HEADER_CACHE_EXTENSION
+"""
+Run the conversion benchmarks on a synthetic VCF and write the results as JSON.
+Each benchmark runs in a fresh spawned process so that its peak RSS is measured on its own.
+Reported per benchmark: seconds (best of --repeat runs), rows/s, MB/s of input VCF and peak RSS.
+The header cache sidecar of the VCF is deleted before each run, so every run parses the header
+as it would for a new VCF.
+"""
+
+def _bench_vcf2tsv_header(vcf_file_path, output_dir):
+    from vcf2tsv import VCF2TSV
+    VCF2TSV(vcf_file_path).write_header_to_file(os.path.join(output_dir, 'header.txt'))
+
+def _bench_vcf2tsv_body(vcf_file_path, output_dir):
+    from vcf2tsv import VCF2TSV
+    VCF2TSV(vcf_file_path).write_body_to_file(os.path.join(output_dir, 'body.tsv'))
+
+def _bench_vcf2tsv_tab(vcf_file_path, output_dir):
+    from vcf2tsv import VCF2TSV
+    VCF2TSV(vcf_file_path).convert_vcf_to_tsv_output(os.path.join(output_dir, 'tab.tsv'), 'tab')
+
+def _bench_vcf2tsv_json(vcf_file_path, output_dir):
+    from vcf2tsv import VCF2TSV
+    VCF2TSV(vcf_file_path).convert_vcf_to_tsv_output(os.path.join(output_dir, 'json.tsv'), 'json')
+
+def _bench_vcf_to_files(vcf_file_path, output_dir):
+    from vcf_to_files import VCFToFiles
+    VCFToFiles(vcf_file_path, output_dir).write_variant_rows_to_files()
+
+def _bench_vcf_meta_parser(vcf_file_path, output_dir):
+    from vcf_meta_parser import VCFMetaParser
+    VCFMetaParser(vcf_file_path, output_dir).create_info_dict_list()
+
+def _bench_sqlite_load(vcf_file_path, output_dir):
+    from vcf_to_sqlite import VCFToSQLite
+    VCFToSQLite(vcf_file_path, os.path.join(output_dir, 'vcf.db')).load()
+
+# Benchmark name -> (function, whether it processes the data rows)
+BENCHMARKS = {
+    'vcf2tsv_header': (_bench_vcf2tsv_header, False),
+    'vcf2tsv_body': (_bench_vcf2tsv_body, True),
+    'vcf2tsv_tab': (_bench_vcf2tsv_tab, True),
+    'vcf2tsv_json': (_bench_vcf2tsv_json, True),
+    'vcf_to_files': (_bench_vcf_to_files, True),
+    'vcf_meta_parser': (_bench_vcf_meta_parser, False),
+    'sqlite_load': (_bench_sqlite_load, True)}
+
+def _get_peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    if sys.platform == 'darwin':
+        return peak_rss / 1024 / 1024
+    return peak_rss / 1024
+
+def _run_benchmark(benchmark_name, vcf_file_path, output_dir, result_queue):
+    """Child process entry point: run one benchmark once and report its time and peak RSS."""
+    benchmark_function = BENCHMARKS[benchmark_name][0]
+    start_time = time.perf_counter()
+    benchmark_function(vcf_file_path, output_dir)
+    seconds = time.perf_counter() - start_time
+    result_queue.put((seconds, _get_peak_rss_mb()))
+
+def run_benchmark(benchmark_name, vcf_file_path, row_count, repeat=3):
+    """Run a benchmark repeat times, each in a new process, and return its result dictionary."""
+    context = multiprocessing.get_context('spawn')
+    timings = []
+    header_cache_file_path = vcf_file_path + HEADER_CACHE_EXTENSION
+    for _ in range(repeat):
+        if os.path.exists(header_cache_file_path):
+            os.remove(header_cache_file_path)
+        output_dir = tempfile.mkdtemp(prefix='mybix_bench_')
+        try:
+            result_queue = context.Queue()
+            process = context.Process(target=_run_benchmark,
+                                      args=(benchmark_name, vcf_file_path, output_dir, result_queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError('Benchmark {} failed with exit code {}'.format(
+                    benchmark_name, process.exitcode))
+            seconds, peak_rss_mb = result_queue.get()
+            timings.append((seconds, peak_rss_mb))
+        finally:
+            shutil.rmtree(output_dir)
+    seconds = min(timing[0] for timing in timings)
+    input_mb = os.path.getsize(vcf_file_path) / 1024 / 1024
+    processes_rows = BENCHMARKS[benchmark_name][1]
+    return {
+        'name': benchmark_name,
+        'seconds': round(seconds, 4),
+        'rows_per_s': round(row_count / seconds) if processes_rows else None,
+        'mb_per_s': round(input_mb / seconds, 2) if processes_rows else None,
+        'peak_rss_mb': round(max(timing[1] for timing in timings), 1)}
+
+def _get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(benchmark_names=None, rows=200000, info_keys=10, flag_count=5, flag_density=0.3,
+                   samples=0, seed=0, repeat=3, value_types=INFO_TYPES):
+    """Generate the synthetic VCF, run the named benchmarks (all by default) and return the
+    results dictionary. value_types are the Types the key=value INFO fields cycle through."""
+    benchmark_names = benchmark_names or list(BENCHMARKS)
+    work_dir = tempfile.mkdtemp(prefix='mybix_bench_vcf_')
+    try:
+        vcf_file_path = write_synthetic_vcf(os.path.join(work_dir, 'synthetic.vcf'), rows=rows,
+                                            info_keys=info_keys, flag_count=flag_count,
+                                            flag_density=flag_density, value_types=value_types,
+                                            samples=samples, seed=seed)
+        results = [run_benchmark(benchmark_name, vcf_file_path, rows, repeat)
+                   for benchmark_name in benchmark_names]
+        input_bytes = os.path.getsize(vcf_file_path)
+    finally:
+        shutil.rmtree(work_dir)
+    return {
+        'git_commit': _get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'vcf': {'rows': rows, 'info_keys': info_keys, 'flag_count': flag_count,
+                'flag_density': flag_density, 'value_types': list(value_types),
+                'samples': samples, 'seed': seed,
+                'bytes': input_bytes},
+        'results': results}
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the mybix conversion benchmarks.')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--info-keys', type=int, default=10)
+    parser.add_argument('--flags', type=int, default=5)
+    parser.add_argument('--flag-density', type=float, default=0.3)
+    parser.add_argument('--value-types', nargs='+', choices=INFO_TYPES, default=list(INFO_TYPES),
+                        help='Types the key=value INFO fields cycle through')
+    parser.add_argument('--samples', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Benchmarks to run')
+    parser.add_argument('--output', help='JSON results file, printed to stdout if not given')
+    args = parser.parse_args()
+    results = run_benchmarks(args.only, args.rows, args.info_keys, args.flags, args.flag_density,
+                             args.samples, args.seed, args.repeat, args.value_types)
+    results_json = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'wt') as fho:
+            fho.write(results_json + os.linesep)
+    else:
+        print(results_json)
+
+if __name__ == '__main__':
+    main()
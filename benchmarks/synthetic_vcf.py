@@ -0,0 +1,91 @@
+import os
+import random
+"""
+Deterministic synthetic VCF generator for benchmarks. The same arguments and seed always
+produce the same file, so results can be compared across commits without external data.
+"""
+
+INFO_TYPES = ('Integer', 'Float', 'String')
+BASES = 'ACGT'
+
+def make_info_definitions(info_keys, value_types, flag_count):
+    """Return a list of (ID, Number, Type) tuples: info_keys key=value fields cycling through
+    value_types, with every fifth one a Number=A list, followed by flag_count flags."""
+    info_definitions = []
+    for key_index in range(info_keys):
+        info_type = value_types[key_index % len(value_types)]
+        number = 'A' if key_index % 5 == 4 and info_type != 'String' else '1'
+        info_definitions.append(('KEY{}_{}'.format(key_index, info_type.upper()), number, info_type))
+    for flag_index in range(flag_count):
+        info_definitions.append(('FLAG{}'.format(flag_index), '0', 'Flag'))
+    return info_definitions
+
+def _make_value(rng, info_type, string_values):
+    if info_type == 'Integer':
+        return str(rng.randint(-100, 10000))
+    if info_type == 'Float':
+        return str(round(rng.random(), 4))
+    return rng.choice(string_values)
+
+def write_synthetic_vcf(output_file, rows=100000, info_keys=10, flag_count=5, flag_density=0.3,
+                        value_types=INFO_TYPES, samples=0, chromosomes=('1', '2', 'X'),
+                        missing_id_density=0.0, seed=0):
+    """Write a sorted synthetic VCF and return its path.
+    rows: number of data rows, split evenly over the chromosomes
+    info_keys: number of key=value INFO fields, cycling through value_types
+    flag_count, flag_density: number of Flag INFO fields and the chance each is set on a row
+    samples: number of sample columns, with GT:DP:GQ FORMAT fields
+    missing_id_density: chance of an ID being '.'; the SQLite schema needs unique IDs so it is 0
+    by default
+    About 10% of the INFO values are left out of each row."""
+    rng = random.Random(seed)
+    info_definitions = make_info_definitions(info_keys, value_types, flag_count)
+    string_values = ['SNV', 'indel', 'insertion', 'deletion', 'substitution']
+    genotypes = ['0/0', '0/1', '1/1', '0|1', '1|0', './.']
+    with open(output_file, 'wt') as fho:
+        fho.write('##fileformat=VCFv4.2' + os.linesep)
+        fho.write('##source=mybix_synthetic_vcf_seed_{}'.format(seed) + os.linesep)
+        for chrom in chromosomes:
+            fho.write('##contig=<ID={},length=250000000>'.format(chrom) + os.linesep)
+        for info_id, number, info_type in info_definitions:
+            fho.write('##INFO=<ID={},Number={},Type={},Description="Synthetic {} field, for '
+                      'benchmarks">'.format(info_id, number, info_type, info_type) + os.linesep)
+        if samples:
+            fho.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">' + os.linesep)
+            fho.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">' + os.linesep)
+            fho.write('##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype quality">' + os.linesep)
+        column_names = ['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']
+        if samples:
+            column_names.append('FORMAT')
+            column_names.extend('SAMPLE{}'.format(sample_index) for sample_index in range(samples))
+        fho.write('\t'.join(column_names) + os.linesep)
+        rows_per_chrom = (rows + len(chromosomes) - 1) // len(chromosomes)
+        row_index = 0
+        for chrom in chromosomes:
+            position = 0
+            for _ in range(min(rows_per_chrom, rows - row_index)):
+                position += rng.randint(1, 200)
+                ref = rng.choice(BASES) if rng.random() < 0.9 else ''.join(
+                    rng.choice(BASES) for _ in range(rng.randint(2, 8)))
+                alt = rng.choice([base for base in BASES if base != ref[0]])
+                variant_id = 'rs{}'.format(row_index + 1) if rng.random() >= missing_id_density else '.'
+                info_elements = []
+                for info_id, number, info_type in info_definitions:
+                    if info_type == 'Flag':
+                        if rng.random() < flag_density:
+                            info_elements.append(info_id)
+                    elif rng.random() < 0.9:
+                        info_elements.append('{}={}'.format(info_id, _make_value(rng, info_type, string_values)))
+                row = [chrom, str(position), variant_id, ref, alt, str(rng.randint(10, 99)), 'PASS',
+                       ';'.join(info_elements) or '.']
+                if samples:
+                    row.append('GT:DP:GQ')
+                    row.extend('{}:{}:{}'.format(rng.choice(genotypes), rng.randint(0, 80), rng.randint(0, 99))
+                               for _ in range(samples))
+                fho.write('\t'.join(row) + os.linesep)
+                row_index += 1
+    return output_file
+
+if __name__ == '__main__':
+    import sys
+    write_synthetic_vcf(sys.argv[1], rows=int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
@@ -0,0 +1,69 @@
+/*
+Cohort schema for vcf_batch_loader.py: the compact schema in compact_vcf_ddl.sql extended
+so that many VCFs can be appended to one database.
+Each loaded VCF gets a source_file row, identified by the SHA-256 hash of its content so
+that a file is only ever loaded once. Other files with the same content get a
+source_file_alias row, so later runs skip them without hashing them again. Variants are shared between files: a variant is
+stored once per (chromosome, position, ref_allele, alt_allele) and variant_source records
+the files it was seen in. INFO values can differ between files, e.g. per-sample depths,
+so the INFO tables are keyed by source file as well.
+The indexes are created up front since the tables are appended to, not bulk loaded once.
+*/
+CREATE TABLE source_file(
+  source_file_id INTEGER PRIMARY KEY,
+  file_path TEXT,
+  content_hash TEXT NOT NULL UNIQUE,
+  file_size INT,
+  file_mtime REAL,
+  -- Tab-separated
+  sample_names TEXT,
+  variant_count INT,
+  loaded_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE source_file_alias(
+  file_path TEXT PRIMARY KEY,
+  file_size INT,
+  file_mtime REAL,
+  content_hash TEXT NOT NULL
+);
+CREATE TABLE variant(
+  variant_rowid INTEGER PRIMARY KEY,
+  chromosome TEXT,
+  position INT,
+  variant_id TEXT,
+  ref_allele TEXT,
+  alt_allele TEXT,
+  UNIQUE(chromosome, position, ref_allele, alt_allele)
+);
+CREATE TABLE variant_source(
+  variant_rowid INTEGER,
+  source_file_id INTEGER,
+  PRIMARY KEY(variant_rowid, source_file_id)
+) WITHOUT ROWID;
+CREATE TABLE info_key(
+  info_key_id INTEGER PRIMARY KEY,
+  info_key TEXT NOT NULL UNIQUE
+);
+CREATE TABLE info_flag(
+  variant_rowid INTEGER,
+  info_key_id INTEGER,
+  source_file_id INTEGER,
+  PRIMARY KEY(variant_rowid, info_key_id, source_file_id)
+) WITHOUT ROWID;
+CREATE TABLE info_key_num_val(
+  variant_rowid INTEGER,
+  info_key_id INTEGER,
+  source_file_id INTEGER,
+  info_num_val REAL,
+  PRIMARY KEY(variant_rowid, info_key_id, source_file_id)
+) WITHOUT ROWID;
+CREATE TABLE info_key_str_val(
+  variant_rowid INTEGER,
+  info_key_id INTEGER,
+  source_file_id INTEGER,
+  info_str_val TEXT,
+  PRIMARY KEY(variant_rowid, info_key_id, source_file_id)
+) WITHOUT ROWID;
+CREATE INDEX var_id_variant_idx ON variant(variant_id);
+CREATE INDEX source_variant_source_idx ON variant_source(source_file_id);
+CREATE INDEX key_num_val_idx ON info_key_num_val(info_key_id, info_num_val);
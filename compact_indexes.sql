@@ -0,0 +1,4 @@
+CREATE INDEX var_id_variant_idx ON variant(variant_id);
+CREATE INDEX chr_pos_variant_idx ON variant(chromosome, position);
+CREATE INDEX key_num_val_idx ON info_key_num_val(info_key_id, info_num_val);
+ANALYZE;
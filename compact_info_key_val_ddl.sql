@@ -0,0 +1,11 @@
+/*
+Load table for the compact INFO key-value file written by VCFToFiles(compact=True).
+Used by files2sqlite.sh only: compact_info_numeric_value_move.sql copies its rows into
+info_key_num_val and info_key_str_val and the table is then dropped.
+*/
+CREATE TABLE info_key_val(
+    variant_rowid INTEGER,
+    info_key_id INTEGER,
+    info_val TEXT,
+    datatype TEXT
+);
@@ -0,0 +1,26 @@
+/*
+Populate the compact info_key_num_val and info_key_str_val tables with
+the appropriate data from the load table info_key_val.
+The load file is in variant_rowid order so the rows are appended to the clustered tables.
+A key repeated within one INFO column keeps its first value.
+*/
+
+INSERT OR IGNORE INTO info_key_num_val(variant_rowid, info_key_id, info_num_val)
+SELECT
+  variant_rowid,
+  info_key_id,
+  info_val
+FROM
+  info_key_val
+WHERE
+  datatype = 'num';
+
+INSERT OR IGNORE INTO info_key_str_val(variant_rowid, info_key_id, info_str_val)
+SELECT
+  variant_rowid,
+  info_key_id,
+  info_val
+FROM
+  info_key_val
+WHERE
+  datatype = 'str';
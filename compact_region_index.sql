@@ -0,0 +1,13 @@
+ALTER TABLE variant ADD COLUMN end_position INT;
+ALTER TABLE variant ADD COLUMN bin INT;
+UPDATE variant SET end_position = position + max(length(ref_allele), 1) - 1;
+UPDATE variant SET bin =
+  CASE
+    WHEN (position - 1) >> 17 = (end_position - 1) >> 17 THEN 585 + ((position - 1) >> 17)
+    WHEN (position - 1) >> 20 = (end_position - 1) >> 20 THEN 73 + ((position - 1) >> 20)
+    WHEN (position - 1) >> 23 = (end_position - 1) >> 23 THEN 9 + ((position - 1) >> 23)
+    WHEN (position - 1) >> 26 = (end_position - 1) >> 26 THEN 1 + ((position - 1) >> 26)
+    ELSE 0
+  END;
+CREATE INDEX chr_bin_variant_idx ON variant(chromosome, bin, position, end_position);
+ANALYZE;
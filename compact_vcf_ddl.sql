@@ -0,0 +1,36 @@
+/*
+Compact alternative to vcf_ddl.sql.
+Variants are identified by an INTEGER rowid instead of their ID text, which is often '.'
+and need not be unique, and INFO keys and flags by a small integer id into info_key.
+The INFO tables are WITHOUT ROWID tables clustered on (variant_rowid, info_key_id) so
+they need no separate unique index.
+*/
+CREATE TABLE variant(
+  variant_rowid INTEGER PRIMARY KEY,
+  chromosome TEXT,
+  position INT,
+  variant_id TEXT,
+  ref_allele TEXT,
+  alt_allele TEXT
+);
+CREATE TABLE info_key(
+  info_key_id INTEGER PRIMARY KEY,
+  info_key TEXT NOT NULL UNIQUE
+);
+CREATE TABLE info_flag(
+  variant_rowid INTEGER,
+  info_key_id INTEGER,
+  PRIMARY KEY(variant_rowid, info_key_id)
+) WITHOUT ROWID;
+CREATE TABLE info_key_num_val(
+  variant_rowid INTEGER,
+  info_key_id INTEGER,
+  info_num_val REAL,
+  PRIMARY KEY(variant_rowid, info_key_id)
+) WITHOUT ROWID;
+CREATE TABLE info_key_str_val(
+  variant_rowid INTEGER,
+  info_key_id INTEGER,
+  info_str_val TEXT,
+  PRIMARY KEY(variant_rowid, info_key_id)
+) WITHOUT ROWID;
@@ -5,12 +5,14 @@
 #   script is run
 # 2., 3., and 4. The names of the file contaning the variant detals, the the INFO key-val pairs 
 #   and the INFO flags
+# 5. Optional: the INFO keys file written by VCFToFiles(compact=True). When given, the files
+#   are the compact ones and are loaded into the compact schema (compact_*.sql scripts)
 # Warning: Removes the SQLite file of that name if it already exists!
 # Assumes the SQL scripts it uses are in the dame directory as this shell script
 # Uses a HEREDOC to execute a series of SQLite commands to:
 # - Set the mode to tabs (assuming the input files are tab-delimited!)
 # - Set headers on
-# - Execute an external SQL DDL script to create the tables
+# - Execute external SQL DDL scripts to create the tables and the INFO key-value load table
 # - Three import statements import the files into the tables just created
 # - Split the INFO key-value data into string and numeric by executing an external SQL script
 # - Create the indexes
@@ -22,8 +24,8 @@
 SCRIPT_DIR=$(dirname "$0")
 
 # Ensure the correct number of arguments is passed to the script
-if [ "$#" -ne 4 ]; then
-    echo "Error! Expected four arguments got $# Exiting!"
+if [ "$#" -ne 4 ] && [ "$#" -ne 5 ]; then
+    echo "Error! Expected four or five arguments got $# Exiting!"
     exit 1
 
 fi
@@ -31,9 +33,20 @@ SQLITE_DB_NAME=$1
 FILE_VARIANT_DETAILS=$2
 FILE_INFO_KEY_VAL=$3
 FILE_INFO_FLAG=$4
-SQL_DDL_FILE=$SCRIPT_DIR/vcf_ddl.sql
-SQL_INDEX_FILE=$SCRIPT_DIR/indexes.sql
-SQL_INFO_NUM_MOVE_FILE=$SCRIPT_DIR/info_numeric_value_move.sql
+FILE_INFO_KEY=$5
+if [ -z "$FILE_INFO_KEY" ]; then
+    SQL_PREFIX=
+    VARIANT_TABLE=variant_detail
+    IMPORT_INFO_KEY=
+else
+    SQL_PREFIX=compact_
+    VARIANT_TABLE=variant
+    IMPORT_INFO_KEY=".import $FILE_INFO_KEY info_key"
+fi
+SQL_DDL_FILE=$SCRIPT_DIR/${SQL_PREFIX}vcf_ddl.sql
+SQL_LOAD_DDL_FILE=$SCRIPT_DIR/${SQL_PREFIX}info_key_val_ddl.sql
+SQL_INDEX_FILE=$SCRIPT_DIR/${SQL_PREFIX}indexes.sql
+SQL_INFO_NUM_MOVE_FILE=$SCRIPT_DIR/${SQL_PREFIX}info_numeric_value_move.sql
 # Warning: Removes SQLite DB if it already exists!
 [ ! -e $SQLITE_DB_NAME ] || rm $SQLITE_DB_NAME
 # Execute SQLite commands
@@ -45,9 +58,11 @@ pragma mmap_size = 30000000000;
 .mode tabs
 .headers on
 .read $SQL_DDL_FILE
-.import $FILE_VARIANT_DETAILS variant_detail
+.read $SQL_LOAD_DDL_FILE
+.import $FILE_VARIANT_DETAILS $VARIANT_TABLE
 .import $FILE_INFO_KEY_VAL info_key_val
 .import $FILE_INFO_FLAG info_flag
+$IMPORT_INFO_KEY
 .read $SQL_INFO_NUM_MOVE_FILE 
 .read $SQL_INDEX_FILE
 DROP TABLE info_key_val;
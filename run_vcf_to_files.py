@@ -1,6 +1,10 @@
 from vcf_to_files import VCFToFiles
 import sys
-vcf_file_path = sys.argv[1]
-dir_path = sys.argv[2]
-vcf2files = VCFToFiles(vcf_file_path, dir_path)
-vcf2files.write_variant_rows_to_files()  
\ No newline at end of file
+
+if __name__ == '__main__':
+    vcf_file_path = sys.argv[1]
+    dir_path = sys.argv[2]
+    # Optional third argument: number of worker processes for parallel parsing
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    vcf2files = VCFToFiles(vcf_file_path, dir_path, workers=workers)
+    vcf2files.write_variant_rows_to_files()
@@ -0,0 +1,36 @@
+/*
+Summary tables written by vcf_summary.VCFSummary.write_tables, replacing any earlier ones.
+INFO keys are stored as text so the tables are the same for the default and compact schemas.
+Histogram bins start at bin_start and run up to the next bin: multiples of 0.05 from 0 up to
+1 and powers of ten outside that range.
+*/
+DROP TABLE IF EXISTS summary_variant;
+DROP TABLE IF EXISTS summary_chromosome;
+DROP TABLE IF EXISTS summary_info_num;
+DROP TABLE IF EXISTS summary_info_num_histogram;
+DROP TABLE IF EXISTS summary_info_flag;
+CREATE TABLE summary_variant(
+  variant_count INT
+);
+CREATE TABLE summary_chromosome(
+  chromosome TEXT PRIMARY KEY,
+  variant_count INT
+);
+CREATE TABLE summary_info_num(
+  info_key TEXT PRIMARY KEY,
+  value_count INT,
+  min_val REAL,
+  max_val REAL,
+  sum_val REAL,
+  mean_val REAL
+);
+CREATE TABLE summary_info_num_histogram(
+  info_key TEXT,
+  bin_start REAL,
+  bin_count INT,
+  PRIMARY KEY(info_key, bin_start)
+) WITHOUT ROWID;
+CREATE TABLE summary_info_flag(
+  info_key TEXT PRIMARY KEY,
+  variant_count INT
+);
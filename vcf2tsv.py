@@ -1,8 +1,11 @@
 import os
 import sys
-import csv
-import re
-import json
+from vcf_header import VCFHeader, parse_meta_line
+from vcf_stream import VCFStream, HeaderFileSink, open_output_file, get_output_file_size
+from vcf_info_parser import InfoParser
+from vcf_columnar import ColumnarSink
+from vcf_genotypes import GenotypeSink
+from vcf_summary import SummarySink
 
 """
 VCF (Variant Call Format) version 4.0 parser. Create TSV file versions for loading into
@@ -17,71 +20,75 @@ class VCF2TSV:
     """
     def __init__(self, vcf_file_path):
         """
-        Provide a full path to a readable standard VCF file.
+        Provide a full path to a readable standard VCF file, plain text or gzip/bgzip compressed.
         """
         self.vcf_file_path = vcf_file_path
         if not os.path.exists(self.vcf_file_path):
             raise IOError('Given file "{}" does not exist!'.format(self.vcf_file_path))
-        self.info_schema = self.generate_info_schema()
+        self._info_schema = None
+        self._info_parser = None
+
+    @property
+    def info_schema(self):
+        """The INFO schema, see generate_info_schema. It is generated on first use, either from
+        the header lines passed to the output sinks or by reading the header from the file."""
+        if self._info_schema is None:
+            self._info_schema = self.generate_info_schema()
+        return self._info_schema
+
+    @property
+    def info_parser(self):
+        """The InfoParser compiled from the INFO schema, used by the INFO conversion methods."""
+        if self._info_parser is None:
+            self._info_parser = InfoParser.from_info_schema(self.info_schema)
+        return self._info_parser
+
+    def set_header_lines(self, header_lines):
+        """Generate the INFO schema from already read header lines if it isn't set yet."""
+        if self._info_schema is None:
+            info_rows = [row for row in header_lines if row.startswith('##INFO')]
+            self._info_schema = self.generate_info_schema(info_rows)
 
     def write_header_to_file(self, output_file):
         """Write the header lines, that is, those beginning with ## to a given output file
         """
-        fho = open(output_file, 'wt')
-        with open(self.vcf_file_path) as fh:
-            for row in fh:
-                if row.startswith('#CHROM'): break
-                fho.write(row)
-        fho.close()
-
-    def write_body_to_file(self, output_file):
+        self.write_outputs(header_file=output_file)
+
+    def write_body_to_file(self, output_file, regions=None):
         """Write that actual variant data rows to a TSV file.
         No processing is done on the INFO column in this method. 
         VCF QUAL and FILTER columns are dropped.
+        An optional list of regions such as ["chr1:1-5000000"] restricts the output to the
+        variants overlapping them.
         """
-        column_names = ['chrom', 'position', 'variant_id', 'ref_allele', 'alt_allele', 'info']
-        column_indexes_to_keep = [0, 1, 2, 3, 4, 7]
-        row_start = False
-        fho = open(output_file, 'wt')
-        fho.write('\t'.join(column_names) + os.linesep)
-        with open(self.vcf_file_path) as fh:
-            csv_reader = csv.reader(fh, delimiter='\t', quotechar='"')
-            for row in csv_reader:
-                if row_start:
-                    columns_keep =[row[i] for i in column_indexes_to_keep]
-                    fho.write(('\t').join(columns_keep) + os.linesep)
-                if row[0].startswith('#CHROM'):
-                    row_start = True
-        fho.close() 
+        self.write_outputs(body_file=output_file, regions=regions)
 
     def get_info_rows(self):
-        """Return a list containing all the header rows beginning with ##.
+        """Return a list containing all the header rows beginning with ##INFO.
         Returned list is the input for methods that extract the INFO IDs
-        and their associated values.
+        and their associated values. The header is taken from the VCFHeader cache.
         """
-        info_rows = []
-        with open(self.vcf_file_path) as fh:
-            for row in fh:
-                if row.startswith('#CHROM'): break
-                if row.startswith('##INFO'):
-                    info_rows.append(row)
-        return info_rows
-
-    def generate_info_schema(self):
+        return [row for row in VCFHeader.load_or_read(self.vcf_file_path).header_lines
+                if row.startswith('##INFO')]
+
+    def generate_info_schema(self, info_rows=None):
         """Parse a list containing the indivual INFO entries to generate
         a dictionary of dictionaries mapping INFO ID to INFO details.
+        The INFO entries are taken from the VCFHeader cache if no rows are given.
+        The inner dictionaries hold every property of the INFO entry except ID and Description.
         """
-        info_rows = self.get_info_rows()
-        regex_pat = r'[<](.+),Description="'
+        if info_rows is None:
+            info_definitions = VCFHeader.load_or_read(self.vcf_file_path).info.values()
+        else:
+            info_definitions = [parse_meta_line(info_row)[1] for info_row in info_rows]
         info_schema = {}
         column_index = 0 # Added to inner dicts to file set output column values for info entries
-        for info_row in info_rows:
-            match = re.search(regex_pat, info_row)
-            if match:
-                matched_info = match.group(1)
-                info_schema_element = dict(entry.split("=") for entry in matched_info.split(','))
-                element_id = info_schema_element['ID']
-                info_schema_element.pop('ID') 
+        for info_definition in info_definitions:
+            if isinstance(info_definition, dict) and 'ID' in info_definition:
+                info_schema_element = {info_property: info_val for info_property, info_val
+                                       in info_definition.items()
+                                       if info_property not in ('ID', 'Description')}
+                element_id = info_definition['ID']
                 info_schema_element['column_index'] = column_index
                 column_index +=1
                 info_schema[element_id] = info_schema_element
@@ -109,23 +116,9 @@ class VCF2TSV:
         specified in the VCF header may not be in the given input. Each individual INFO entry
         is assumed to be a sub-set of all the INFO entries in the VCF header.
         This method deals with these scenarios by assigning 'X' to keys with no values
-        and None to absent INFO IDs
+        and None to absent INFO IDs. INFO IDs not declared in the header are skipped.
         """
-        info_elements = info_column_value.strip().split(';')
-        # Some INFO columns contain empty values (";;"); this causes a key error where the key
-        # '' does not exists. The following filter removes empty elements.
-        info_elements = [info_element for info_element in info_elements 
-                            if len(info_element.strip()) > 0]
-        key, val = None, None
-        extracted_values = [None] * len(list(self.info_schema.keys()))
-        for info_element in info_elements:
-            if '=' in info_element:
-                key, val = info_element.split('=')
-            else:
-                key, val = info_element, 'X'
-            column_position = self.info_schema[key]['column_index']
-            extracted_values[column_position] = val
-        return extracted_values
+        return self.info_parser.parse_to_columns(info_column_value)
 
     def get_column_names_for_info_output_type(self, info_output_type):
         """Return a list of column names for output files.
@@ -148,63 +141,144 @@ class VCF2TSV:
         """Converts the given INFO input into JSON where INFO elements with key=value
         format are reresented as dictionary keys mapped to values and flags, that is entries
         not assigned by =, are appended to a list called 'flags'.
+        Values are typed according to the INFO Type and Number in the header: numbers for
+        Integer and Float, lists for Number values other than 0 and 1, and null for '.'.
+        Numbers are written with their text from the VCF.
         """
-        info_column_map = dict(flags = [])
-        info_elements = info_column_value.strip().split(';')
-        info_elements = [info_element for info_element in info_elements 
-                            if len(info_element.strip()) > 0]
-        key, val = None, None
-        for info_element in info_elements:
-            if '=' in info_element:
-                key, val = info_element.split('=')
-                info_column_map[key] = val
-            else:
-                info_column_map['flags'].append(info_element)
-        return json.dumps(info_column_map)
-
-    def _write_parsed_vcf_output(self, output_file, info_parsing_function, info_output_type):
-        """Create a TSV of the VCF file with the INFO either broken into separate columns 
-        for each INFO ID or with INFO converted into a single JSON string column. The INFO
-        output format depends on the passed in method reference value and the value 
-        of the 'info_output_type' argument
-        VCF QUAL and FILTER columns are dropped. 
+        return self.info_parser.to_json(info_column_value)
+
+    def get_info_parsing_function(self, info_output_type):
+        """Return the INFO parsing method for the given info_output_type, tab or json."""
+        if info_output_type == 'tab':
+            return self.convert_info_to_columns
+        elif info_output_type == 'json':
+            return self.convert_info_to_json
+        else:
+            raise ValueError('Unrecognised info_output_type: {}'.format(info_output_type))
+
+    def format_parsed_row(self, row, info_parsing_function):
+        """Return an output line for a VCF data row with the INFO either broken into separate
+        columns for each INFO ID or with INFO converted into a single JSON string column,
+        depending on the passed in method reference value.
+        VCF QUAL and FILTER columns are dropped.
         """
-        column_names = self.get_column_names_for_info_output_type(info_output_type)
-        column_indexes_to_keep = [0, 1, 2, 3, 4, 7]
-        row_start = False
-        fho = open(output_file, 'wt')
-        fho.write('\t'.join(column_names) + os.linesep)
-        with open(self.vcf_file_path) as fh:
-            csv_reader = csv.reader(fh, delimiter='\t', quotechar='"')
-            for row in csv_reader:
-                if row_start:
-                    columns_keep =[row[i] for i in column_indexes_to_keep]
-                    info_column = columns_keep.pop()
-                    info_column_parsed = info_parsing_function(info_column)
-                    # This check is used to determine which of list methods 'extend' or 'append'
-                    #  is appropriate for adding the output from 'info_parsing_function' to list
-                    # containing the other columns of the VCF row. 
-                    if isinstance(info_column_parsed, list):
-                        columns_keep.extend(info_column_parsed)
-                        columns_keep = [str(column_value or '.') for column_value in columns_keep]
-                    else:
-                        columns_keep.append(info_column_parsed)
-                    fho.write(('\t').join(columns_keep) + os.linesep)
-                if row[0].startswith('#CHROM'):
-                    row_start = True
-        fho.close()
-
-    def convert_vcf_to_tsv_output(self, output_file, info_output_type):
+        columns_keep = row[:5]
+        info_column_parsed = info_parsing_function(row[7])
+        # This check is used to determine which of list methods 'extend' or 'append'
+        #  is appropriate for adding the output from 'info_parsing_function' to list
+        # containing the other columns of the VCF row. 
+        if isinstance(info_column_parsed, list):
+            columns_keep.extend(info_column_parsed)
+            columns_keep = [str(column_value or '.') for column_value in columns_keep]
+        else:
+            columns_keep.append(info_column_parsed)
+        return ('\t').join(columns_keep) + os.linesep
+
+    def add_output_sinks(self, vcf_stream, header_file=None, body_file=None, tab_file=None,
+                         json_file=None, columnar_dir=None, genotype_dir=None, summary_file=None):
+        """Register a sink on the given VCFStream for each output file path given:
+        the header lines, the body TSV with INFO unprocessed, the TSV with INFO split into
+        columns, the TSV with INFO as a JSON column, the directory for the columnar
+        binary files (see vcf_columnar), the directory for the GT matrix of the sample
+        columns (see vcf_genotypes) and the JSON summary statistics (see vcf_summary)."""
+        if header_file:
+            vcf_stream.add_sink(HeaderFileSink(header_file))
+        if body_file:
+            vcf_stream.add_sink(VCF2TSVSink(self, body_file, 'body'))
+        if tab_file:
+            vcf_stream.add_sink(VCF2TSVSink(self, tab_file, 'tab'))
+        if json_file:
+            vcf_stream.add_sink(VCF2TSVSink(self, json_file, 'json'))
+        if columnar_dir:
+            vcf_stream.add_sink(ColumnarSink(columnar_dir))
+        if genotype_dir:
+            vcf_stream.add_sink(GenotypeSink(genotype_dir))
+        if summary_file:
+            vcf_stream.add_sink(SummarySink(summary_file))
+
+    def write_outputs(self, header_file=None, body_file=None, tab_file=None, json_file=None,
+                      columnar_dir=None, regions=None, checkpoint_path=None, stats=None,
+                      genotype_dir=None, summary_file=None):
+        """Write any mix of the header, body, tab, json, columnar, genotype and summary outputs
+        in a single read of the VCF. Outputs are only written for the file paths given.
+        With a checkpoint_path the run is checkpointed there and a re-run of an interrupted
+        job continues from the last checkpoint (not supported for the columnar and genotype
+        outputs).
+        Pass a vcf_profile.PipelineStats as stats to collect stage timings and progress."""
+        vcf_stream = VCFStream(self.vcf_file_path, regions, checkpoint_path, stats=stats)
+        self.add_output_sinks(vcf_stream, header_file, body_file, tab_file, json_file, columnar_dir,
+                              genotype_dir, summary_file)
+        vcf_stream.run()
+
+    def convert_vcf_to_tsv_output(self, output_file, info_output_type, regions=None,
+                                  checkpoint_path=None, stats=None):
         """ Wraps the calls to the parsing methods for generating file output.
         The 'info_output_type' parameter determines which INFO parsing method is called.
+        For the 'columnar' info_output_type, output_file is the directory to write the
+        column files to; read them with vcf_columnar.ColumnarReader.
+        An optional list of regions such as ["chr1:1-5000000"] restricts the output to the
+        variants overlapping them. The VCF must then be position-sorted and either uncompressed
+        or bgzip compressed; a region index is built next to it on first use.
+        See write_outputs for checkpoint_path and stats.
         """
         if info_output_type == 'tab':
-            self._write_parsed_vcf_output(output_file, self.convert_info_to_columns, info_output_type)
+            self.write_outputs(tab_file=output_file, regions=regions,
+                               checkpoint_path=checkpoint_path, stats=stats)
         elif info_output_type == 'json':
-            self._write_parsed_vcf_output(output_file, self.convert_info_to_json, info_output_type)
+            self.write_outputs(json_file=output_file, regions=regions,
+                               checkpoint_path=checkpoint_path, stats=stats)
+        elif info_output_type == 'columnar':
+            self.write_outputs(columnar_dir=output_file, regions=regions,
+                               checkpoint_path=checkpoint_path, stats=stats)
         else:
             raise ValueError('Unrecognised info_output_type: {}'.format(info_output_type))
 
+class VCF2TSVSink:
+    """VCFStream sink writing one of the VCF2TSV TSV outputs. The output_type is body for the
+    data rows with INFO unprocessed, or an info_output_type, tab or json."""
+    needs_samples = False
+
+    def __init__(self, vcf2tsv, output_file, output_type):
+        self.vcf2tsv = vcf2tsv
+        self.output_file = output_file
+        self.output_type = output_type
+        self.fho = None
+
+    def open(self, header_lines):
+        self.resume(header_lines, None)
+
+    def resume(self, header_lines, state):
+        self.vcf2tsv.set_header_lines(header_lines)
+        if self.output_type == 'body':
+            column_names = ['chrom', 'position', 'variant_id', 'ref_allele', 'alt_allele', 'info']
+        else:
+            column_names = self.vcf2tsv.get_column_names_for_info_output_type(self.output_type)
+            self.info_parsing_function = self.vcf2tsv.get_info_parsing_function(self.output_type)
+        if state:
+            self.fho = open_output_file(self.output_file, state['size'])
+        else:
+            self.fho = open_output_file(self.output_file)
+            self.fho.write('\t'.join(column_names) + os.linesep)
+
+    def checkpoint(self):
+        return {'size': get_output_file_size(self.fho)}
+
+    def instrument(self, stats):
+        stats.time_output_file(self, 'fho')
+        if self.output_type != 'body':
+            stats.time_function(self, 'info_parsing_function', 'info_parse')
+
+    def write_row(self, row):
+        if self.output_type == 'body':
+            columns_keep = row[:5]
+            columns_keep.append(row[7])
+            self.fho.write(('\t').join(columns_keep) + os.linesep)
+        else:
+            self.fho.write(self.vcf2tsv.format_parsed_row(row, self.info_parsing_function))
+
+    def close(self):
+        self.fho.close()
+
 if __name__ == '__main__':
     from pprint import pprint
     dir_path = '{}/big_files/'.format(os.environ['HOME']) 
@@ -221,4 +295,8 @@ if __name__ == '__main__':
     vcf2tsv.convert_vcf_to_tsv_output(parsed_info_tsv_file_path_json, 'json')
     #pprint(vcf2tsv.convert_info_to_json('dbSNP_154;TSA=indel;E_Freq;E_1000G;E_TOPMed;AFR=0.4909;AMR=0.3602;EAS=0.3363;EUR=0.4056;SAS=0.4949'))
     #parsed_info_tsv_file_path_tabs = os.path.join(dir_path, 'parsed_vcf_info_1k_sample_tabs.tsv')
-    #vcf2tsv.convert_vcf_to_tsv_output(parsed_info_tsv_file_path_tabs, 'tab')
\ No newline at end of file
+    #vcf2tsv.convert_vcf_to_tsv_output(parsed_info_tsv_file_path_tabs, 'tab')
+    # All outputs in one read of the VCF
+    #vcf2tsv.write_outputs(header_file=header_file_path, body_file=body_file_path,
+    #                      tab_file=parsed_info_tsv_file_path_tabs,
+    #                      json_file=parsed_info_tsv_file_path_json)
\ No newline at end of file
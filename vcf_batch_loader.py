@@ -0,0 +1,247 @@
+import os
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import multiprocessing
+from vcf_header import VCFHeader
+from vcf_to_sqlite import VCFToSQLite
+"""
+Append a directory, or a manifest file listing one path per line, of VCFs into one shared
+SQLite database with the cohort schema in cohort_vcf_ddl.sql.
+Each VCF is loaded by VCFToSQLite into its own compact staging database, in a process pool
+when workers is more than 1, and each staging database is merged into the shared database
+in a single transaction as soon as it is ready. A variant seen in several VCFs is stored
+once, with a variant_source row per VCF; INFO values are kept per VCF.
+Files are identified by the SHA-256 hash of their content, so a file that is already loaded,
+under any name, is skipped. Files whose path, size and modification time match a loaded file
+are skipped without being hashed, so re-running over a growing directory only reads and
+loads the new files; copies of loaded files are recorded as aliases so that they aren't
+hashed again either. An interrupted run can simply be re-run: each file is merged in one
+transaction, so a file is either fully loaded or not at all.
+    loader = VCFBatchLoader('cohort.db', workers=8)
+    loader.load('daily_vcfs/')
+"""
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+VCF_EXTENSIONS = ('.vcf', '.vcf.gz', '.vcf.bgz')
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def get_vcf_file_paths(path):
+    """Return the absolute paths of the VCFs in a directory, in name order, or listed in a
+    manifest file. Manifest paths are relative to the manifest's directory; blank lines and
+    lines beginning # are ignored."""
+    if os.path.isdir(path):
+        return [os.path.abspath(os.path.join(path, file_name))
+                for file_name in sorted(os.listdir(path))
+                if file_name.endswith(VCF_EXTENSIONS)
+                and os.path.isfile(os.path.join(path, file_name))]
+    manifest_dir = os.path.dirname(os.path.abspath(path))
+    vcf_file_paths = []
+    with open(path) as fh:
+        for line in fh:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                vcf_file_paths.append(os.path.abspath(os.path.join(manifest_dir, line)))
+    return vcf_file_paths
+
+def get_content_hash(file_path):
+    """Return the hex SHA-256 digest of a file's content."""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def _hash_file(vcf_file_path):
+    """Process pool function: return the path and content hash of a VCF."""
+    return vcf_file_path, get_content_hash(vcf_file_path)
+
+def _load_staging_db(args):
+    """Process pool function: load a VCF into a new compact staging database without
+    indexes and return the VCF path, the staging database path, the number of variants
+    and the sample names."""
+    vcf_file_path, staging_db_path = args
+    variant_count = VCFToSQLite(vcf_file_path, staging_db_path, compact=True,
+                                create_indexes=False).load()
+    # The header was cached by the load
+    sample_names = VCFHeader.load_or_read(vcf_file_path).sample_names
+    return vcf_file_path, staging_db_path, variant_count, sample_names
+
+class VCFBatchLoader:
+    """Incrementally load VCF files into a shared cohort database, skipping files that
+    are already loaded and de-duplicating the variants they share.
+    """
+    # Run in order with the staging database attached as staging; :source_file_id is the
+    # id of the file being merged
+    merge_statements = [
+        '''INSERT OR IGNORE INTO info_key(info_key)
+           SELECT info_key FROM staging.info_key ORDER BY info_key_id''',
+        # A variant loaded before with no ID picks up the ID of a later file
+        '''INSERT INTO variant(chromosome, position, variant_id, ref_allele, alt_allele)
+           SELECT chromosome, position, variant_id, ref_allele, alt_allele
+           FROM staging.variant WHERE true ORDER BY variant_rowid
+           ON CONFLICT(chromosome, position, ref_allele, alt_allele) DO UPDATE
+           SET variant_id = excluded.variant_id
+           WHERE variant.variant_id = '.' AND excluded.variant_id <> '.' ''',
+        '''CREATE TEMP TABLE variant_map(staging_rowid INTEGER PRIMARY KEY, variant_rowid INTEGER)''',
+        '''INSERT INTO variant_map(staging_rowid, variant_rowid)
+           SELECT sv.variant_rowid, v.variant_rowid
+           FROM staging.variant sv
+           JOIN main.variant v ON v.chromosome = sv.chromosome AND v.position = sv.position
+             AND v.ref_allele = sv.ref_allele AND v.alt_allele = sv.alt_allele''',
+        '''CREATE TEMP TABLE info_key_map(staging_key_id INTEGER PRIMARY KEY, info_key_id INTEGER)''',
+        '''INSERT INTO info_key_map(staging_key_id, info_key_id)
+           SELECT sk.info_key_id, k.info_key_id
+           FROM staging.info_key sk JOIN main.info_key k ON k.info_key = sk.info_key''',
+        '''INSERT OR IGNORE INTO variant_source(variant_rowid, source_file_id)
+           SELECT variant_rowid, :source_file_id FROM variant_map''',
+        '''INSERT OR IGNORE INTO info_key_num_val(variant_rowid, info_key_id, source_file_id,
+             info_num_val)
+           SELECT vm.variant_rowid, km.info_key_id, :source_file_id, s.info_num_val
+           FROM staging.info_key_num_val s
+           JOIN variant_map vm ON vm.staging_rowid = s.variant_rowid
+           JOIN info_key_map km ON km.staging_key_id = s.info_key_id''',
+        '''INSERT OR IGNORE INTO info_key_str_val(variant_rowid, info_key_id, source_file_id,
+             info_str_val)
+           SELECT vm.variant_rowid, km.info_key_id, :source_file_id, s.info_str_val
+           FROM staging.info_key_str_val s
+           JOIN variant_map vm ON vm.staging_rowid = s.variant_rowid
+           JOIN info_key_map km ON km.staging_key_id = s.info_key_id''',
+        '''INSERT OR IGNORE INTO info_flag(variant_rowid, info_key_id, source_file_id)
+           SELECT vm.variant_rowid, km.info_key_id, :source_file_id
+           FROM staging.info_flag s
+           JOIN variant_map vm ON vm.staging_rowid = s.variant_rowid
+           JOIN info_key_map km ON km.staging_key_id = s.info_key_id''',
+        'DROP TABLE variant_map',
+        'DROP TABLE info_key_map']
+
+    def __init__(self, sqlite_db_path, workers=1):
+        """Instantiate with the path of the cohort database, which is created if it doesn't
+        exist, and an optional number of worker processes to load the VCFs with."""
+        self.sqlite_db_path = sqlite_db_path
+        self.workers = workers
+        self.ddl_file_path = os.path.join(SCRIPT_DIR, 'cohort_vcf_ddl.sql')
+
+    def _connect(self):
+        """Return a connection to the cohort database, creating its tables if needed."""
+        conn = sqlite3.connect(self.sqlite_db_path, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA cache_size = -1000000')
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'source_file'"
+                        ).fetchone() is None:
+            with open(self.ddl_file_path) as fh:
+                conn.executescript('BEGIN;' + fh.read() + 'COMMIT;')
+        return conn
+
+    def _get_new_files(self, conn, vcf_file_paths, pool_map):
+        """Return a list of (path, content hash) tuples for the VCFs that are not loaded yet,
+        keeping only the first of any files with the same content, and a list of
+        (file key, content hash) tuples, the file key as returned by _get_file_key, for the
+        other hashed files, which are copies of loaded or new files."""
+        loaded_files = set()
+        loaded_hashes = set()
+        for file_path, file_size, file_mtime, content_hash in conn.execute(
+                '''SELECT file_path, file_size, file_mtime, content_hash FROM source_file
+                   UNION ALL
+                   SELECT file_path, file_size, file_mtime, content_hash FROM source_file_alias'''):
+            loaded_files.add((file_path, file_size, file_mtime))
+            loaded_hashes.add(content_hash)
+        file_keys = {vcf_file_path: self._get_file_key(vcf_file_path)
+                     for vcf_file_path in vcf_file_paths}
+        unhashed_file_paths = [vcf_file_path for vcf_file_path in vcf_file_paths
+                               if file_keys[vcf_file_path] not in loaded_files]
+        new_files = []
+        duplicate_files = []
+        for vcf_file_path, content_hash in pool_map(_hash_file, unhashed_file_paths):
+            if content_hash in loaded_hashes:
+                duplicate_files.append((file_keys[vcf_file_path], content_hash))
+            else:
+                loaded_hashes.add(content_hash)
+                new_files.append((vcf_file_path, content_hash))
+        return new_files, duplicate_files
+
+    def _get_file_key(self, vcf_file_path):
+        file_stat = os.stat(vcf_file_path)
+        return vcf_file_path, file_stat.st_size, file_stat.st_mtime
+
+    def _add_aliases(self, conn, duplicate_files):
+        """Record the copies of loaded files so that later runs skip them without hashing.
+        Copies of files that failed to load are left to be hashed again."""
+        conn.executemany(
+            '''INSERT OR REPLACE INTO source_file_alias(file_path, file_size, file_mtime,
+                 content_hash)
+               SELECT ?, ?, ?, content_hash FROM source_file WHERE content_hash = ?''',
+            [file_key + (content_hash,) for file_key, content_hash in duplicate_files])
+
+    def _merge_staging_db(self, conn, vcf_file_path, content_hash, staging_db_path,
+                          variant_count, sample_names):
+        """Merge a staging database into the cohort database in one transaction and return
+        the new source_file_id."""
+        conn.execute('ATTACH DATABASE ? AS staging', (staging_db_path,))
+        try:
+            conn.execute('BEGIN')
+            try:
+                file_path, file_size, file_mtime = self._get_file_key(vcf_file_path)
+                cursor = conn.execute(
+                    '''INSERT INTO source_file(file_path, content_hash, file_size, file_mtime,
+                       sample_names, variant_count) VALUES(?, ?, ?, ?, ?, ?)''',
+                    (file_path, content_hash, file_size, file_mtime, '\t'.join(sample_names),
+                     variant_count))
+                source_file_id = cursor.lastrowid
+                for merge_statement in self.merge_statements:
+                    conn.execute(merge_statement, {'source_file_id': source_file_id})
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.execute('DETACH DATABASE staging')
+        return source_file_id
+
+    def load(self, path):
+        """Load the VCFs in the directory or manifest at path that are not already in the
+        cohort database. Return a list of (path, variant count) tuples for the files loaded."""
+        vcf_file_paths = get_vcf_file_paths(path)
+        conn = self._connect()
+        # Staging databases go next to the cohort database, which should have room for them
+        staging_dir = tempfile.mkdtemp(prefix='vcf_batch_',
+                                       dir=os.path.dirname(os.path.abspath(self.sqlite_db_path)))
+        pool = multiprocessing.Pool(self.workers) if self.workers > 1 else None
+        try:
+            new_files, duplicate_files = self._get_new_files(conn, vcf_file_paths,
+                                                             pool.imap if pool else map)
+            content_hashes = dict(new_files)
+            load_args = [(vcf_file_path, os.path.join(staging_dir, '{}.db'.format(file_number)))
+                         for file_number, (vcf_file_path, content_hash) in enumerate(new_files)]
+            loaded_files = []
+            # Staging databases are merged in the order they finish loading
+            load_results = pool.imap_unordered(_load_staging_db, load_args) if pool \
+                else map(_load_staging_db, load_args)
+            for vcf_file_path, staging_db_path, variant_count, sample_names in load_results:
+                self._merge_staging_db(conn, vcf_file_path, content_hashes[vcf_file_path],
+                                       staging_db_path, variant_count, sample_names)
+                os.remove(staging_db_path)
+                loaded_files.append((vcf_file_path, variant_count))
+            self._add_aliases(conn, duplicate_files)
+            if loaded_files:
+                # Sampled statistics so the cost doesn't grow with the cohort
+                conn.execute('PRAGMA analysis_limit = 1000')
+                conn.execute('ANALYZE')
+            return loaded_files
+        finally:
+            if pool:
+                pool.terminate()
+            conn.close()
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    import sys
+    # Arguments: cohort database path, VCF directory or manifest path, optional worker count
+    sqlite_db_path = sys.argv[1]
+    path = sys.argv[2]
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    for vcf_file_path, variant_count in VCFBatchLoader(sqlite_db_path, workers).load(path):
+        print('{}\t{}'.format(vcf_file_path, variant_count))
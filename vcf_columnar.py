@@ -0,0 +1,269 @@
+import os
+import re
+import sys
+import json
+from array import array
+from vcf_info_parser import InfoParser
+try:
+    import numpy as np
+except ImportError:
+    np = None
+"""
+Columnar binary output for VCF data rows: one file per column so that downstream analysis can
+memory-map just the columns it scans instead of re-parsing the TSV outputs.
+Column encodings:
+    fixed:      little-endian fixed width values (NumPy dtype in the manifest) for position and
+                scalar Integer (int64) and Float (float64) INFO fields
+    flag:       one uint8 0/1 value per row for Flag INFO fields
+    dictionary: int32 codes into a list of distinct values for chrom and scalar String INFO fields
+    string:     int64 end offsets into a UTF-8 data file for variant ID, alleles and list INFO fields
+Nullable columns have a validity bitmap with one bit per row, least significant bit first,
+set when the value is present. Missing fixed values are stored as 0 (int64) or NaN (float64).
+The manifest.json file in the output directory describes the columns and the row count.
+"""
+
+MANIFEST_FILE_NAME = 'manifest.json'
+NULL_CODE = -1
+
+def _pack_bits(bits):
+    """Pack a list of booleans into bytes, least significant bit first."""
+    packed = bytearray((len(bits) + 7) // 8)
+    for bit_index, bit in enumerate(bits):
+        if bit:
+            packed[bit_index >> 3] |= 1 << (bit_index & 7)
+    return bytes(packed)
+
+def _write_array(values, fho):
+    """Write an array to a file in little-endian byte order."""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(fho)
+
+class _Column:
+    """Buffers the values of one output column and appends them to its files."""
+    def __init__(self, name, encoding, output_dir, typecode=None, nullable=True):
+        self.name = name
+        self.encoding = encoding
+        self.typecode = typecode
+        self.nullable = nullable
+        file_base = os.path.join(output_dir, re.sub(r'[^\w.-]', '_', name))
+        self.file_names = {'data': file_base + '.data'}
+        if nullable:
+            self.file_names['valid'] = file_base + '.valid'
+        if encoding == 'string':
+            self.file_names['offsets'] = file_base + '.offsets'
+            self.end_offset = 0
+        if encoding == 'dictionary':
+            self.file_names['dictionary'] = file_base + '.dictionary.json'
+            self.dictionary = {}
+        self.file_handles = {file_key: open(file_name, 'wb') for file_key, file_name
+                                in self.file_names.items() if file_key != 'dictionary'}
+        self.clear()
+
+    def clear(self):
+        self.values = array(self.typecode) if self.typecode else []
+        self.valid = []
+
+    def append(self, value):
+        """Add a value, None for missing."""
+        if self.encoding == 'dictionary' and value is not None:
+            value = self.dictionary.setdefault(value, len(self.dictionary))
+        if value is None:
+            self.valid.append(False)
+            if self.encoding == 'dictionary':
+                value = NULL_CODE
+            elif self.encoding == 'string':
+                value = ''
+            elif self.typecode == 'd':
+                value = float('nan')
+            else:
+                value = 0
+        else:
+            self.valid.append(True)
+        self.values.append(value)
+
+    def flush(self):
+        """Append the buffered values to the column files. Called with a multiple of 8 rows
+        except for the last flush, so the validity bitmaps can simply be concatenated."""
+        if self.encoding == 'string':
+            offsets = array('q')
+            data = []
+            for value in self.values:
+                encoded_value = value.encode('utf-8')
+                self.end_offset += len(encoded_value)
+                offsets.append(self.end_offset)
+                data.append(encoded_value)
+            _write_array(offsets, self.file_handles['offsets'])
+            self.file_handles['data'].write(b''.join(data))
+        else:
+            _write_array(self.values, self.file_handles['data'])
+        if self.nullable:
+            self.file_handles['valid'].write(_pack_bits(self.valid))
+        self.clear()
+
+    def close(self):
+        self.flush()
+        for fh in self.file_handles.values():
+            fh.close()
+        if self.encoding == 'dictionary':
+            with open(self.file_names['dictionary'], 'wt') as fho:
+                json.dump(list(self.dictionary), fho)
+
+    def describe(self):
+        """Return the manifest entry for the column."""
+        dtypes = {'q': '<i8', 'd': '<f8', 'i': '<i4', 'B': 'u1'}
+        return {
+            'name': self.name,
+            'encoding': self.encoding,
+            'dtype': dtypes.get(self.typecode),
+            'nullable': self.nullable,
+            'files': {file_key: os.path.basename(file_name)
+                        for file_key, file_name in self.file_names.items()}}
+
+class ColumnarSink:
+    """VCFStream sink writing the chrom, position, variant ID, ref and alt alleles and every
+    INFO field declared in the header as columnar binary files in an output directory.
+    VCF QUAL and FILTER columns are dropped, as in the TSV outputs."""
+    needs_samples = False
+
+    def __init__(self, output_dir, flush_rows=65536):
+        """Provide the output directory, created if needed, and the number of rows to buffer
+        before appending to the column files; it is rounded up to a multiple of 8."""
+        self.output_dir = output_dir
+        self.flush_rows = (flush_rows + 7) // 8 * 8
+
+    def open(self, header_lines):
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        make_column = lambda name, encoding, typecode=None, nullable=True: _Column(
+            name, encoding, self.output_dir, typecode, nullable)
+        self.base_columns = [
+            make_column('chrom', 'dictionary', 'i', nullable=False),
+            make_column('position', 'fixed', 'q', nullable=False),
+            make_column('variant_id', 'string'),
+            make_column('ref_allele', 'string', nullable=False),
+            make_column('alt_allele', 'string')]
+        self.info_parser = InfoParser.from_header_lines(header_lines)
+        # INFO ID -> (column, value type) where value type is int or float for numbers, str for
+        # strings and lists, which are kept as they are, and bool for flags
+        self.info_columns = {}
+        for info_definition in self.info_parser.info_definitions:
+            info_id = info_definition['ID']
+            converter, is_list = self.info_parser.value_specs[info_id]
+            if info_definition['Type'] == 'Flag':
+                column, value_type = make_column(info_id, 'flag', 'B', nullable=False), bool
+            elif is_list:
+                column, value_type = make_column(info_id, 'string'), str
+            elif converter is int:
+                column, value_type = make_column(info_id, 'fixed', 'q'), int
+            elif converter is float:
+                column, value_type = make_column(info_id, 'fixed', 'd'), float
+            else:
+                column, value_type = make_column(info_id, 'dictionary', 'i'), str
+            self.info_columns[info_id] = (column, value_type)
+        self.row_count = 0
+        self.buffered_row_count = 0
+
+    def write_row(self, row):
+        chrom, position, variant_id, ref_allele, alt_allele = row[:5]
+        base_columns = self.base_columns
+        base_columns[0].append(chrom)
+        base_columns[1].append(int(position))
+        base_columns[2].append(None if variant_id == '.' else variant_id)
+        base_columns[3].append(ref_allele)
+        base_columns[4].append(None if alt_allele == '.' else alt_allele)
+        info_values = self.info_parser.parse(row[7], split_lists=False)
+        for info_id, (column, value_type) in self.info_columns.items():
+            value = info_values.get(info_id)
+            if value_type is bool:
+                value = value is True
+            elif value is True:
+                value = None
+            # Values that don't match their declared number type are left out
+            elif value is not None and value_type is not str and type(value) is not value_type:
+                value = None
+            column.append(value)
+        self.row_count += 1
+        self.buffered_row_count += 1
+        if self.buffered_row_count == self.flush_rows:
+            for column in self.get_columns():
+                column.flush()
+            self.buffered_row_count = 0
+
+    def get_columns(self):
+        return self.base_columns + [column for column, _ in self.info_columns.values()]
+
+    def close(self):
+        columns = self.get_columns()
+        for column in columns:
+            column.close()
+        manifest = {
+            'row_count': self.row_count,
+            'columns': [column.describe() for column in columns]}
+        with open(os.path.join(self.output_dir, MANIFEST_FILE_NAME), 'wt') as fho:
+            json.dump(manifest, fho, indent=2)
+
+class ColumnarReader:
+    """Read the columns written by ColumnarSink with numpy.memmap so that a scan such as
+    reader.column('AFR') > 0.4 only touches the bytes of that column.
+    """
+    def __init__(self, output_dir):
+        if np is None:
+            raise ImportError('ColumnarReader requires numpy')
+        self.output_dir = output_dir
+        with open(os.path.join(output_dir, MANIFEST_FILE_NAME)) as fh:
+            manifest = json.load(fh)
+        self.row_count = manifest['row_count']
+        self.columns = {column['name']: column for column in manifest['columns']}
+
+    def get_column_names(self):
+        return list(self.columns)
+
+    def _get_file_path(self, name, file_key):
+        return os.path.join(self.output_dir, self.columns[name]['files'][file_key])
+
+    def _memmap(self, name, file_key, dtype, count):
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._get_file_path(name, file_key), dtype=dtype, mode='r', shape=(count,))
+
+    def column(self, name):
+        """Return a memory-mapped array of the column values: the values for fixed and flag
+        columns, the int32 codes (-1 for missing) for dictionary columns and the end offsets
+        into the data file for string columns."""
+        column = self.columns[name]
+        if column['encoding'] == 'string':
+            return self._memmap(name, 'offsets', '<i8', self.row_count)
+        return self._memmap(name, 'data', column['dtype'], self.row_count)
+
+    def is_valid(self, name):
+        """Return a boolean array that is True where the column has a value."""
+        if not self.columns[name]['nullable']:
+            return np.ones(self.row_count, dtype=bool)
+        packed = self._memmap(name, 'valid', 'u1', (self.row_count + 7) // 8)
+        return np.unpackbits(packed, count=self.row_count, bitorder='little').astype(bool)
+
+    def dictionary(self, name):
+        """Return the list of distinct values of a dictionary column, indexed by code."""
+        with open(self._get_file_path(name, 'dictionary')) as fh:
+            return json.load(fh)
+
+    def strings(self, name, row_indexes=None):
+        """Return the values of a string or dictionary column as a list of str, None for
+        missing, for all rows or only the given row indexes."""
+        column = self.columns[name]
+        if row_indexes is None:
+            row_indexes = range(self.row_count)
+        valid = self.is_valid(name)
+        if column['encoding'] == 'dictionary':
+            dictionary = self.dictionary(name)
+            codes = self.column(name)
+            return [dictionary[codes[i]] if valid[i] else None for i in row_indexes]
+        offsets = self.column(name)
+        data = self._memmap(name, 'data', 'u1', int(offsets[-1]) if self.row_count else 0)
+        values = []
+        for i in row_indexes:
+            start = int(offsets[i - 1]) if i > 0 else 0
+            values.append(bytes(data[start:int(offsets[i])]).decode('utf-8') if valid[i] else None)
+        return values
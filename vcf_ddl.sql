@@ -1,9 +1,3 @@
-CREATE TABLE info_key_val(
-    variant_id TEXT,
-    info_key TEXT,
-    info_val TEXT,
-    datatype TEXT
-);
 CREATE TABLE info_flag(
   variant_id TEXT,
   info_flag TEXT
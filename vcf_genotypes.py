@@ -0,0 +1,276 @@
+import os
+import json
+from array import array
+from vcf_stream import VCFStream
+from vcf_info_parser import parse_format_header_lines
+from vcf_columnar import _write_array
+try:
+    import numpy as np
+except ImportError:
+    np = None
+"""
+Genotype extraction from the FORMAT and sample columns, which the TSV outputs drop.
+GT is written as an int8 matrix of variants x samples, one byte per genotype, and any scalar
+Integer or Float FORMAT fields asked for, such as DP and GQ, as int32 and float32 matrices.
+The matrices are split into blocks of sample_block_size samples, one file per block and
+field, each in variant-major order: memory use while writing is bounded by buffer_bytes
+whatever the number of samples, and reading a few samples only touches their blocks.
+GT codes, shown as unsigned bytes:
+    diploid:  first allele in bits 0-2, second allele in bits 3-5, bit 6 set if phased
+    haploid:  0x80 | allele
+    missing:  0xFF (-1 as int8) when the sample has no GT value or it has more than two alleles
+Allele values 0-5 are the allele indexes, 6 stands for index 6 or above and 7 for a missing
+allele ('.'), so './.' is 0x3F and '0|1' is 0x48.
+Missing Integer values are stored as INT32_MISSING and missing Float values as NaN.
+The manifest.json file in the output directory lists the samples, fields and block files.
+"""
+
+MANIFEST_FILE_NAME = 'manifest.json'
+MISSING_CODE = 0xFF
+HAPLOID_FLAG = 0x80
+PHASED_FLAG = 0x40
+MISSING_ALLELE = 7
+MAX_ALLELE = 6
+INT32_MISSING = -2 ** 31
+SAMPLE_BLOCK_SIZE = 1024
+BUFFER_BYTES = 64 * 1024 * 1024
+
+def _encode_allele(allele):
+    if allele == '.' or not allele.isdigit():
+        return MISSING_ALLELE
+    return min(int(allele), MAX_ALLELE)
+
+def encode_genotype(gt):
+    """Return the GT code, as an unsigned byte value, for a GT value such as '0/1' or '1'."""
+    if gt in ('', '.'):
+        return MISSING_CODE
+    phased = '|' in gt
+    alleles = gt.replace('|', '/').split('/')
+    if len(alleles) == 1:
+        return HAPLOID_FLAG | _encode_allele(alleles[0])
+    if len(alleles) > 2:
+        return MISSING_CODE
+    code = _encode_allele(alleles[0]) | _encode_allele(alleles[1]) << 3
+    return code | PHASED_FLAG if phased else code
+
+def decode_genotype(code):
+    """Return the GT string for a GT code, the inverse of encode_genotype for alleles below 6.
+    Signed int8 codes, such as the NumPy int8 values of GenotypeReader.genotypes, are accepted."""
+    code = int(code) & 0xFF
+    if code == MISSING_CODE:
+        return '.'
+    allele_strings = [str(allele) for allele in range(MAX_ALLELE)] + ['6+', '.']
+    if code & HAPLOID_FLAG:
+        return allele_strings[code & 7]
+    separator = '|' if code & PHASED_FLAG else '/'
+    return allele_strings[code & 7] + separator + allele_strings[code >> 3 & 7]
+
+class _GenotypeCodes(dict):
+    """GT value -> code cache; a VCF has few distinct GT values so this is a dictionary lookup
+    per sample."""
+    def __missing__(self, gt):
+        code = self[gt] = encode_genotype(gt)
+        return code
+
+def _convert_integer(value):
+    try:
+        return int(value)
+    except ValueError:
+        return INT32_MISSING
+
+def _convert_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return float('nan')
+
+class GenotypeSink:
+    """VCFStream sink writing the GT matrix and the chosen numeric FORMAT fields of every
+    sample to an output directory, see the module docstring for the layout.
+    Rows are in input order so row i matches row i of the other outputs of the same run.
+    """
+    def __init__(self, output_dir, format_fields=None, sample_block_size=SAMPLE_BLOCK_SIZE,
+                 buffer_bytes=BUFFER_BYTES):
+        """Provide the output directory, created if needed, an optional list of scalar Integer
+        or Float FORMAT field IDs to write besides GT, the number of samples per block and
+        the approximate number of bytes to buffer before appending to the block files."""
+        self.output_dir = output_dir
+        self.format_fields = list(format_fields or [])
+        self.sample_block_size = sample_block_size
+        self.buffer_bytes = buffer_bytes
+
+    def open(self, header_lines):
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.samples = header_lines[-1].rstrip('\r\n').split('\t')[9:]
+        format_definitions = {format_definition['ID']: format_definition
+                              for format_definition in parse_format_header_lines(header_lines)}
+        # Field ID -> (array typecode, value converter), GT first
+        self.field_specs = {'GT': ('B', None)}
+        for field_id in self.format_fields:
+            format_definition = format_definitions.get(field_id)
+            if format_definition is None:
+                raise ValueError('FORMAT field {} is not declared in the header'.format(field_id))
+            if format_definition['Number'] != '1' or format_definition['Type'] not in ('Integer', 'Float'):
+                raise ValueError('FORMAT field {} is not a scalar Integer or Float'.format(field_id))
+            if format_definition['Type'] == 'Integer':
+                self.field_specs[field_id] = ('i', _convert_integer)
+            else:
+                self.field_specs[field_id] = ('f', _convert_float)
+        self.block_bounds = [(start, min(start + self.sample_block_size, len(self.samples)))
+                             for start in range(0, len(self.samples), self.sample_block_size)]
+        # (field ID, block index) -> output file handle and buffered values
+        self.file_handles = {}
+        self.buffers = {}
+        for field_id, (typecode, _) in self.field_specs.items():
+            for block_index in range(len(self.block_bounds)):
+                file_path = os.path.join(self.output_dir, self._get_file_name(field_id, block_index))
+                self.file_handles[field_id, block_index] = open(file_path, 'wb')
+                self.buffers[field_id, block_index] = array(typecode)
+        bytes_per_row = sum(array(typecode).itemsize for typecode, _ in self.field_specs.values())
+        self.flush_rows = max(1, self.buffer_bytes // max(1, bytes_per_row * len(self.samples)))
+        self.gt_codes = _GenotypeCodes()
+        # FORMAT column value -> list of (field ID, index in the sample values)
+        self.format_layouts = {}
+        self.row_count = 0
+        self.buffered_row_count = 0
+
+    def _get_file_name(self, field_id, block_index):
+        return '{}.block{}.data'.format(field_id, block_index)
+
+    def _get_format_layout(self, format_value):
+        format_keys = format_value.split(':')
+        format_layout = [(field_id, format_keys.index(field_id)) for field_id in self.field_specs
+                         if field_id in format_keys]
+        self.format_layouts[format_value] = format_layout
+        return format_layout
+
+    def write_row(self, row):
+        sample_values = row[9:]
+        sample_count = len(self.samples)
+        if len(sample_values) != sample_count:
+            raise ValueError('Expected {} sample columns, got {}: {}'.format(
+                sample_count, len(sample_values), ' '.join(row[:5])))
+        format_value = row[8] if len(row) > 8 else ''
+        format_layout = self.format_layouts.get(format_value)
+        if format_layout is None:
+            format_layout = self._get_format_layout(format_value)
+        field_values = {}
+        if format_layout == [('GT', 0)]:
+            field_values['GT'] = [sample_value.partition(':')[0] for sample_value in sample_values]
+        elif format_layout:
+            split_values = [sample_value.split(':') for sample_value in sample_values]
+            for field_id, field_index in format_layout:
+                field_values[field_id] = [values[field_index] if len(values) > field_index else '.'
+                                          for values in split_values]
+        for field_id, (typecode, converter) in self.field_specs.items():
+            values = field_values.get(field_id)
+            if field_id == 'GT':
+                values = bytes(map(self.gt_codes.__getitem__, values)) if values else \
+                    bytes([MISSING_CODE]) * sample_count
+            elif values:
+                values = [converter(value) for value in values]
+            else:
+                values = [converter('.')] * sample_count
+            for block_index, (start, end) in enumerate(self.block_bounds):
+                if typecode == 'B':
+                    self.buffers[field_id, block_index].frombytes(values[start:end])
+                else:
+                    self.buffers[field_id, block_index].extend(values[start:end])
+        self.row_count += 1
+        self.buffered_row_count += 1
+        if self.buffered_row_count >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered rows to the block files."""
+        for key, values in self.buffers.items():
+            _write_array(values, self.file_handles[key])
+            self.buffers[key] = array(values.typecode)
+        self.buffered_row_count = 0
+
+    def close(self):
+        self.flush()
+        for fh in self.file_handles.values():
+            fh.close()
+        dtypes = {'B': 'i1', 'i': '<i4', 'f': '<f4'}
+        manifest = {
+            'row_count': self.row_count,
+            'samples': self.samples,
+            'fields': [{'name': field_id, 'dtype': dtypes[typecode]}
+                       for field_id, (typecode, _) in self.field_specs.items()],
+            'blocks': [{'start': start, 'end': end,
+                        'files': {field_id: self._get_file_name(field_id, block_index)
+                                  for field_id in self.field_specs}}
+                       for block_index, (start, end) in enumerate(self.block_bounds)]}
+        with open(os.path.join(self.output_dir, MANIFEST_FILE_NAME), 'wt') as fho:
+            json.dump(manifest, fho, indent=2)
+
+def extract_genotypes(vcf_file_path, output_dir, format_fields=None, regions=None,
+                      sample_block_size=SAMPLE_BLOCK_SIZE):
+    """Write the genotype matrices of a VCF, or of the rows overlapping the optional regions,
+    to output_dir. Return the number of variants."""
+    vcf_stream = VCFStream(vcf_file_path, regions)
+    vcf_stream.add_sink(GenotypeSink(output_dir, format_fields, sample_block_size))
+    return vcf_stream.run()
+
+class GenotypeReader:
+    """Read the matrices written by GenotypeSink with numpy.memmap.
+        reader = GenotypeReader('genotypes')
+        alt_counts = reader.alt_allele_counts(['HG00096', 'HG00097'])
+    """
+    def __init__(self, output_dir):
+        if np is None:
+            raise ImportError('GenotypeReader requires numpy')
+        self.output_dir = output_dir
+        with open(os.path.join(output_dir, MANIFEST_FILE_NAME)) as fh:
+            manifest = json.load(fh)
+        self.row_count = manifest['row_count']
+        self.samples = manifest['samples']
+        self.blocks = manifest['blocks']
+        self.dtypes = {field['name']: field['dtype'] for field in manifest['fields']}
+        self.sample_indexes = {sample: sample_index for sample_index, sample
+                                in enumerate(self.samples)}
+
+    def block(self, field_id, block_index):
+        """Return the memory-mapped variants x block samples matrix of a field."""
+        block = self.blocks[block_index]
+        shape = (self.row_count, block['end'] - block['start'])
+        if 0 in shape:
+            return np.zeros(shape, dtype=self.dtypes[field_id])
+        file_path = os.path.join(self.output_dir, block['files'][field_id])
+        return np.memmap(file_path, dtype=self.dtypes[field_id], mode='r', shape=shape)
+
+    def matrix(self, field_id, samples=None):
+        """Return the variants x samples matrix of a field for the given sample names, or all
+        the samples, in the order given. Only the blocks holding those samples are read."""
+        if samples is None:
+            return np.concatenate([self.block(field_id, block_index)
+                                   for block_index in range(len(self.blocks))], axis=1)
+        columns = []
+        for sample in samples:
+            sample_index = self.sample_indexes[sample]
+            for block_index, block in enumerate(self.blocks):
+                if block['start'] <= sample_index < block['end']:
+                    columns.append(self.block(field_id, block_index)[:, sample_index - block['start']])
+                    break
+        return np.stack(columns, axis=1) if columns else np.zeros((self.row_count, 0),
+                                                                   dtype=self.dtypes[field_id])
+
+    def genotypes(self, samples=None):
+        """Return the int8 GT code matrix, see the module docstring."""
+        return self.matrix('GT', samples)
+
+    def alt_allele_counts(self, samples=None):
+        """Return an int8 matrix of the number of non-reference alleles in each genotype,
+        -1 where the genotype or any of its alleles is missing."""
+        codes = self.genotypes(samples).view(np.uint8)
+        haploid = (codes & HAPLOID_FLAG) != 0
+        first_allele = codes & 7
+        second_allele = (codes >> 3) & 7
+        alt_counts = (first_allele > 0).astype(np.int8)
+        alt_counts += (~haploid & (second_allele > 0)).astype(np.int8)
+        missing = ((codes == MISSING_CODE) | (first_allele == MISSING_ALLELE)
+                   | (~haploid & (second_allele == MISSING_ALLELE)))
+        alt_counts[missing] = -1
+        return alt_counts
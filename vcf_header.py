@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import hashlib
+from vcf_io import open_vcf, read_header_lines, VCF_ENCODING
+"""
+Model of a complete VCF header, parsed in one pass and cached in a sidecar file.
+Every meta-line is parsed: structured lines such as ##INFO=<ID=AF,Number=A,Type=Float,
+Description="...">, including ##FORMAT, ##FILTER, ##ALT and ##contig, become dictionaries of
+their fields keyed by ID, with quoted values that contain commas, '=' or escaped quotes
+handled correctly; other lines such as ##fileformat=VCFv4.2 are kept as key-value pairs.
+The header also records the offset of the first data row in the uncompressed VCF, so body
+readers can seek past the header instead of reading it line by line.
+VCFHeader.load_or_read saves the parsed header as JSON next to the VCF, with the extension
+given by HEADER_CACHE_EXTENSION, keyed by the VCF's size and modification time and the
+SHA-256 hash of the header text. Later jobs on an unchanged VCF then don't read its header
+at all, and a VCF whose body changed but whose header didn't is not parsed again.
+    vcf_header = VCFHeader.load_or_read('calls.vcf.gz')
+    vcf_header.info['AF']['Description'], vcf_header.sample_names, vcf_header.data_offset
+"""
+
+HEADER_CACHE_EXTENSION = '.mbxh'
+# VCF path -> (file size, mtime, VCFHeader) of the headers already loaded by this process
+_headers = {}
+# Definitions of the structured meta-lines that are modeled as attributes
+DEFINITION_KEYS = {'info': 'INFO', 'format': 'FORMAT', 'filter': 'FILTER', 'alt': 'ALT',
+                   'contig': 'contig'}
+# key=value fields of a structured meta-line, the value either double quoted with backslash
+# escapes or running up to the next comma
+STRUCTURED_FIELD_PATTERN = re.compile(r'(?:^|,)([^=,]+)=("(?:[^"\\]|\\.)*"|[^,]*)')
+ESCAPE_PATTERN = re.compile(r'\\(.)')
+
+def parse_structured_value(value):
+    """Return a dictionary of the fields of a structured meta-line value such as
+    <ID=DP,Number=1,Type=Integer,Description="Depth, in reads">, in order, with the quotes
+    removed from quoted values and their backslash escapes undone."""
+    body = value[1:-1] if value.endswith('>') else value[1:]
+    fields = {}
+    for match in STRUCTURED_FIELD_PATTERN.finditer(body):
+        field_value = match.group(2)
+        if field_value.startswith('"') and len(field_value) > 1:
+            field_value = ESCAPE_PATTERN.sub(r'\1', field_value[1:-1])
+        fields[match.group(1)] = field_value
+    return fields
+
+def parse_meta_line(meta_line):
+    """Return the key and value of a ## meta-line. The value of a structured line is a
+    dictionary of its fields, that of any other line the text after the first '='."""
+    key, _, value = meta_line.rstrip('\r\n')[2:].partition('=')
+    if value.startswith('<'):
+        return key, parse_structured_value(value)
+    return key, value
+
+class VCFHeader:
+    """The parsed header of a VCF file.
+    header_lines: the header lines up to and including #CHROM, as read by read_header_lines
+    meta: a list of (key, value) tuples, one per ## line, as returned by parse_meta_line
+    info, format, filter, alt, contig: dictionaries of ID -> fields dictionary, in header order
+    column_names, sample_names: the #CHROM line columns and the sample columns
+    data_offset: the offset of the first data row in the uncompressed VCF
+    header_hash: the SHA-256 hex digest of the header text
+    Headers returned by load_or_read are shared within the process so they should not be modified.
+    """
+    def __init__(self, header_lines, data_offset, header_hash=None, meta=None):
+        """Instantiate with the header lines and the data row offset. The hash and parsed
+        meta-lines are computed unless given, as they are for a cached header."""
+        self.header_lines = header_lines
+        self.data_offset = data_offset
+        self.header_hash = header_hash or self.get_header_hash(header_lines)
+        if meta is None:
+            meta = [parse_meta_line(line) for line in header_lines if line.startswith('##')]
+        self.meta = meta
+        definitions = {key: {} for key in DEFINITION_KEYS.values()}
+        for key, value in meta:
+            if key in definitions and isinstance(value, dict) and 'ID' in value:
+                definitions[key][value['ID']] = value
+        for attribute_name, key in DEFINITION_KEYS.items():
+            setattr(self, attribute_name, definitions[key])
+        self.column_names = []
+        if header_lines and header_lines[-1].startswith('#CHROM'):
+            self.column_names = header_lines[-1].rstrip('\r\n').split('\t')
+        self.sample_names = self.column_names[9:]
+
+    @staticmethod
+    def get_header_hash(header_lines):
+        return hashlib.sha256(''.join(header_lines).encode(VCF_ENCODING)).hexdigest()
+
+    def get_definitions(self, key):
+        """Return a dictionary of ID -> fields dictionary for the structured meta-lines with
+        the given key, such as 'INFO' or 'contig'."""
+        return {value['ID']: value for meta_key, value in self.meta
+                if meta_key == key and isinstance(value, dict) and 'ID' in value}
+
+    def get_values(self, key):
+        """Return a list of the values of the meta-lines with the given key, such as 'source'."""
+        return [value for meta_key, value in self.meta if meta_key == key]
+
+    @property
+    def meta_lines(self):
+        """The ## lines without their line endings."""
+        return [line.rstrip('\r\n') for line in self.header_lines if line.startswith('##')]
+
+    @staticmethod
+    def _read_header_lines(vcf_file_path):
+        """Return the header lines of a VCF and the offset of the line after them."""
+        with open_vcf(vcf_file_path, 'rb', seekable=False) as fh:
+            return read_header_lines(fh), fh.tell()
+
+    @classmethod
+    def read(cls, vcf_file_path):
+        """Read and parse the header of a plain or gzip/BGZF compressed VCF."""
+        return cls(*cls._read_header_lines(vcf_file_path))
+
+    def save(self, vcf_file_path, cache_file_path=None):
+        """Write the header as JSON, by default next to the VCF file, keyed by the current
+        size and modification time of the VCF."""
+        cache_file_path = cache_file_path or vcf_file_path + HEADER_CACHE_EXTENSION
+        file_stat = os.stat(vcf_file_path)
+        header_map = {
+            'file_size': file_stat.st_size,
+            'mtime': file_stat.st_mtime,
+            'header_hash': self.header_hash,
+            'data_offset': self.data_offset,
+            'header_lines': self.header_lines,
+            'meta': self.meta}
+        # Replaced atomically as jobs running in parallel on the same VCF may share the cache
+        temp_cache_file_path = '{}.{}.tmp'.format(cache_file_path, os.getpid())
+        with open(temp_cache_file_path, 'wt') as fho:
+            json.dump(header_map, fho)
+        os.replace(temp_cache_file_path, cache_file_path)
+
+    @staticmethod
+    def _load_header_map(cache_file_path):
+        if not os.path.isfile(cache_file_path):
+            return None
+        with open(cache_file_path) as fh:
+            return json.load(fh)
+
+    @staticmethod
+    def _is_current(header_map, file_stat):
+        return header_map['file_size'] == file_stat.st_size and header_map['mtime'] == file_stat.st_mtime
+
+    @classmethod
+    def _from_header_map(cls, header_map):
+        return cls(header_map['header_lines'], header_map['data_offset'], header_map['header_hash'],
+                   [tuple(key_value) for key_value in header_map['meta']])
+
+    @classmethod
+    def load(cls, vcf_file_path, cache_file_path=None):
+        """Read a saved header. Return None if it doesn't exist or the VCF has changed since."""
+        header_map = cls._load_header_map(cache_file_path or vcf_file_path + HEADER_CACHE_EXTENSION)
+        if header_map is None or not cls._is_current(header_map, os.stat(vcf_file_path)):
+            return None
+        return cls._from_header_map(header_map)
+
+    @classmethod
+    def load_or_read(cls, vcf_file_path):
+        """Return the saved header of the VCF, reading it and saving it first if needed.
+        If the VCF changed but its header text didn't, the saved parse is reused.
+        Headers are also kept in memory, so repeated calls in one process only stat the VCF.
+        A VCF in a read-only directory is read once per process."""
+        file_stat = os.stat(vcf_file_path)
+        file_size, mtime, vcf_header = _headers.get(vcf_file_path, (None, None, None))
+        if file_size == file_stat.st_size and mtime == file_stat.st_mtime:
+            return vcf_header
+        vcf_header = cls._load_or_read(vcf_file_path, file_stat)
+        _headers[vcf_file_path] = (file_stat.st_size, file_stat.st_mtime, vcf_header)
+        return vcf_header
+
+    @classmethod
+    def _load_or_read(cls, vcf_file_path, file_stat):
+        cache_file_path = vcf_file_path + HEADER_CACHE_EXTENSION
+        header_map = cls._load_header_map(cache_file_path)
+        if header_map is not None and cls._is_current(header_map, file_stat):
+            return cls._from_header_map(header_map)
+        header_lines, data_offset = cls._read_header_lines(vcf_file_path)
+        header_hash = cls.get_header_hash(header_lines)
+        if header_map is not None and header_map['header_hash'] == header_hash:
+            vcf_header = cls(header_lines, data_offset, header_hash,
+                             [tuple(key_value) for key_value in header_map['meta']])
+        else:
+            vcf_header = cls(header_lines, data_offset, header_hash)
+        try:
+            vcf_header.save(vcf_file_path, cache_file_path)
+        except OSError:
+            pass
+        return vcf_header
+
+if __name__ == '__main__':
+    import sys
+    from pprint import pprint
+    vcf_header = VCFHeader.load_or_read(sys.argv[1])
+    for attribute_name in DEFINITION_KEYS:
+        print(attribute_name)
+        pprint(getattr(vcf_header, attribute_name))
+    print('samples', len(vcf_header.sample_names), 'data offset', vcf_header.data_offset)
@@ -0,0 +1,228 @@
+import re
+import json
+from json.encoder import encode_basestring_ascii
+from vcf_header import parse_meta_line
+"""
+INFO column parser compiled once from the ##INFO Number/Type header definitions.
+The per-key lookups (output column, value converter, list or scalar, num or str datatype)
+are precomputed so each INFO value is split only once, values are converted according to
+their declared Type and keys missing from the header are handled rather than raising.
+"""
+
+# Numbers as SQLite stores them in a REAL column: optional sign, digits, optional exponent
+NUMERIC_PATTERN = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+# The NUMERIC_PATTERN numbers that are also valid JSON number text, for Integer and Float
+# values, and comma-separated lists of them
+JSON_INTEGER = r'-?(?:0|[1-9]\d*)'
+JSON_NUMBER = JSON_INTEGER + r'(?:\.\d+)?(?:[eE][+-]?\d+)?'
+JSON_NUMBER_PATTERNS = {int: re.compile(JSON_INTEGER), float: re.compile(JSON_NUMBER)}
+JSON_NUMBER_LIST_PATTERNS = {converter: re.compile('{0}(?:,{0})*'.format(pattern.pattern))
+                             for converter, pattern in JSON_NUMBER_PATTERNS.items()}
+FLAG_COLUMN_VALUE = 'X'
+
+def _get_definition(fields):
+    """Return the ID, Number and Type of the fields of an ##INFO or ##FORMAT line as returned
+    by vcf_header.parse_meta_line. Missing Number or Type default to '.' and String."""
+    return {'ID': fields['ID'], 'Number': fields.get('Number', '.'), 'Type': fields.get('Type', 'String')}
+
+def _parse_definition_header_lines(header_lines, key):
+    """Return a list of dictionaries with the ID, Number and Type of each header line with
+    the given meta-line key, such as INFO, in header order."""
+    line_prefix = '##{}=<'.format(key)
+    definitions = []
+    for header_line in header_lines:
+        if header_line.startswith(line_prefix):
+            fields = parse_meta_line(header_line)[1]
+            if 'ID' in fields:
+                definitions.append(_get_definition(fields))
+    return definitions
+
+def parse_info_header_lines(header_lines):
+    """Return a list of dictionaries with the ID, Number and Type of each ##INFO header line,
+    in header order. Missing Number or Type default to '.' and String."""
+    return _parse_definition_header_lines(header_lines, 'INFO')
+
+def parse_format_header_lines(header_lines):
+    """Return a list of dictionaries with the ID, Number and Type of each ##FORMAT header
+    line, in header order, as for parse_info_header_lines."""
+    return _parse_definition_header_lines(header_lines, 'FORMAT')
+
+def _convert_value(value, converter):
+    """Convert a single INFO value with int, float or None (keep as str), with '.' as None.
+    Values that don't match their declared type are kept as strings."""
+    if value == '.':
+        return None
+    if converter is None:
+        return value
+    try:
+        return converter(value)
+    except ValueError:
+        return value
+
+def _value_to_json(value, converter):
+    """Return the JSON text for a single INFO value converted as by _convert_value.
+    Integer and Float values that are already valid JSON numbers are written as they are."""
+    if value == '.':
+        return 'null'
+    if converter is not None:
+        if JSON_NUMBER_PATTERNS[converter].fullmatch(value):
+            return value
+        try:
+            return json.dumps(converter(value))
+        except ValueError:
+            pass
+    return encode_basestring_ascii(value)
+
+class InfoParser:
+    """Parse INFO column values using the INFO definitions from a VCF header.
+    Each definition is a dictionary with ID, Number and Type keys as returned by
+    parse_info_header_lines or VCFMetaParser.create_info_maps.
+    """
+    def __init__(self, info_definitions):
+        self.info_definitions = info_definitions
+        self.info_ids = [info_definition['ID'] for info_definition in info_definitions]
+        self.column_indexes = {info_id: column_index for column_index, info_id
+                                in enumerate(self.info_ids)}
+        # INFO ID -> (converter, is_list) where converter is int, float or None for strings
+        self.value_specs = {}
+        # INFO ID -> (JSON member prefix, converter, is_list, fullmatch of the values that can be
+        # written as they are), as used by to_json
+        self.json_specs = {}
+        # INFO IDs declared with a non-numeric Type, whose values always have the 'str' datatype
+        self.str_info_ids = set()
+        # INFO IDs declared with the Integer or Float Type
+        self.numeric_info_ids = set()
+        for info_definition in info_definitions:
+            info_id, number, info_type = (info_definition['ID'], info_definition['Number'],
+                                          info_definition['Type'])
+            converter = {'Integer': int, 'Float': float}.get(info_type)
+            is_list = number not in ('0', '1')
+            self.value_specs[info_id] = (converter, is_list)
+            json_number_patterns = JSON_NUMBER_LIST_PATTERNS if is_list else JSON_NUMBER_PATTERNS
+            self.json_specs[info_id] = (encode_basestring_ascii(info_id) + ': ', converter, is_list,
+                                        json_number_patterns[converter].fullmatch
+                                        if converter is not None else None)
+            if converter is None:
+                self.str_info_ids.add(info_id)
+            else:
+                self.numeric_info_ids.add(info_id)
+
+    @classmethod
+    def from_header_lines(cls, header_lines):
+        """Return a parser for the ##INFO definitions in the given VCF header lines."""
+        return cls(parse_info_header_lines(header_lines))
+
+    @classmethod
+    def from_vcf_header(cls, vcf_header):
+        """Return a parser for the INFO definitions of a vcf_header.VCFHeader."""
+        return cls([_get_definition(info_definition) for info_definition in vcf_header.info.values()])
+
+    @classmethod
+    def from_info_schema(cls, info_schema):
+        """Return a parser for a VCF2TSV info schema, keeping its column order."""
+        info_ids = sorted(info_schema, key=lambda info_id: info_schema[info_id]['column_index'])
+        return cls([{'ID': info_id,
+                     'Number': info_schema[info_id].get('Number', '.'),
+                     'Type': info_schema[info_id].get('Type', 'String')}
+                    for info_id in info_ids])
+
+    def parse(self, info_value, info_fields=None, split_lists=True):
+        """Return a dictionary mapping INFO keys to typed values: int, float or str for
+        Number=0/1 fields, lists for all other Numbers, True for flags and None for '.'.
+        Keys not declared in the header are returned as strings, or True if they are flags.
+        If info_fields is given, only those keys are decoded. If split_lists is False the
+        values of the list fields are returned as they are, such as '0.1,0.2'."""
+        info_map = {}
+        value_specs = self.value_specs
+        for info_element in info_value.split(';'):
+            key, separator, val = info_element.partition('=')
+            if info_fields is not None and key not in info_fields:
+                continue
+            if not separator:
+                if key and key != '.':
+                    info_map[key] = True
+                continue
+            converter, is_list = value_specs.get(key, (None, False))
+            if is_list and split_lists:
+                info_map[key] = [_convert_value(element, converter) for element in val.split(',')]
+            elif val == '.':
+                info_map[key] = None
+            elif converter is None or is_list:
+                info_map[key] = val
+            else:
+                try:
+                    info_map[key] = converter(val)
+                except ValueError:
+                    info_map[key] = val
+        return info_map
+
+    def to_json(self, info_value):
+        """Return the INFO value as a JSON object of the values returned by parse, with the
+        flags in a 'flags' list, as json.dumps would write it. The object is written directly
+        rather than by converting the values and dumping them, and Integer and Float values
+        that are valid JSON numbers keep their text, so 0.10 is written as 0.10 and a Float 1
+        as 1. Keys not declared in the header have string values."""
+        json_members = {}
+        flags = []
+        json_specs = self.json_specs
+        encode = encode_basestring_ascii
+        for info_element in info_value.split(';'):
+            key, separator, val = info_element.partition('=')
+            if not separator:
+                if key and key != '.':
+                    flags.append(encode(key))
+                continue
+            json_spec = json_specs.get(key)
+            if json_spec is None:
+                json_members[key] = encode(key) + ': ' + ('null' if val == '.' else encode(val))
+                continue
+            # Indexed rather than unpacked, as most values take the first branch
+            if json_spec[3] is not None and json_spec[3](val):
+                json_members[key] = json_spec[0] + ('[' + val.replace(',', ', ') + ']'
+                                                    if json_spec[2] else val)
+            elif json_spec[2]:
+                json_members[key] = json_spec[0] + '[' + ', '.join(
+                    [_value_to_json(element, json_spec[1]) for element in val.split(',')]) + ']'
+            else:
+                json_members[key] = json_spec[0] + _value_to_json(val, json_spec[1])
+        json_members = list(json_members.values())
+        json_members.insert(0, '"flags": [' + ', '.join(flags) + ']')
+        return '{' + ', '.join(json_members) + '}'
+
+    def parse_to_columns(self, info_value):
+        """Return a list of the raw INFO values ordered by their header position, with 'X' for
+        flags and None for absent keys. Keys not declared in the header are skipped."""
+        extracted_values = [None] * len(self.info_ids)
+        column_indexes = self.column_indexes
+        for info_element in info_value.split(';'):
+            key, separator, val = info_element.partition('=')
+            column_index = column_indexes.get(key)
+            if column_index is None:
+                column_index = column_indexes.get(key.strip())
+                if column_index is None:
+                    continue
+            extracted_values[column_index] = val if separator else FLAG_COLUMN_VALUE
+        return extracted_values
+
+    def split(self, info_value):
+        """Split an INFO value into a list of (key, value, datatype) tuples for the key=value
+        elements, where datatype is 'num' for single numeric values of Integer, Float and
+        undeclared fields, whatever their Number, and 'str' for lists such as 0.1,0.2, other
+        non-numeric values and the values of fields declared with any other Type, and a list
+        of flags."""
+        info_keys_vals = []
+        info_flags = []
+        str_info_ids = self.str_info_ids
+        is_numeric = NUMERIC_PATTERN.fullmatch
+        for info_element in info_value.split(';'):
+            key, separator, val = info_element.partition('=')
+            if separator:
+                if key in str_info_ids:
+                    info_keys_vals.append((key, val, 'str'))
+                elif val.replace('.', '', 1).isdigit() or is_numeric(val):
+                    info_keys_vals.append((key, val, 'num'))
+                else:
+                    info_keys_vals.append((key, val, 'str'))
+            elif key:
+                info_flags.append(key)
+        return info_keys_vals, info_flags
@@ -0,0 +1,343 @@
+import os
+import csv
+import gzip
+import json
+import zlib
+import struct
+from itertools import chain
+"""
+Input helpers shared by the VCF readers. Opens plain, gzip and BGZF (bgzip) compressed
+VCF files transparently and builds a simple block index so that rows for given genomic
+regions, e.g. "chr1:1-5000000", can be read without scanning the whole file.
+iter_block_rows is the fast path for reading whole files: it reads large binary blocks and
+splits them on newlines and tabs itself instead of going through csv.reader line by line.
+The index is the project's own JSON format (not .tbi) and is written next to the VCF
+with the extension given by INDEX_EXTENSION.
+"""
+
+GZIP_MAGIC = b'\x1f\x8b'
+INDEX_EXTENSION = '.mbxi'
+# Uncompressed files have no blocks so index entries are started every INDEX_BYTE_SPAN bytes
+INDEX_BYTE_SPAN = 64 * 1024
+VCF_ENCODING = 'utf-8'
+# Bytes read at a time by iter_block_rows
+READ_BLOCK_SIZE = 64 * 1024
+
+def get_compression(file_path):
+    """Return 'bgzf', 'gzip' or 'none' for the given file by inspecting its first bytes.
+    BGZF files are gzip files whose header carries a 'BC' extra subfield."""
+    with open(file_path, 'rb') as fh:
+        header = fh.read(18)
+    if not header.startswith(GZIP_MAGIC):
+        return 'none'
+    has_extra_field = len(header) >= 18 and header[3] & 4
+    if has_extra_field and header[12:14] == b'BC':
+        return 'bgzf'
+    return 'gzip'
+
+def strip_vcf_extension(file_name):
+    """Return the file name minus its .vcf, .vcf.gz or .vcf.bgz extension."""
+    for compression_ext in ('.gz', '.bgz'):
+        if file_name.endswith(compression_ext):
+            file_name = file_name[:-len(compression_ext)]
+    return os.path.splitext(file_name)[0]
+
+def open_vcf(file_path, mode='rt', seekable=True):
+    """Open a plain or gzip/BGZF compressed VCF file for reading.
+    Mode 'rt' returns a text handle, mode 'rb' a binary handle. Binary handles on BGZF
+    files are BGZFReader instances so they support tell and seek with virtual offsets,
+    unless seekable is False: sequential reads are faster with a plain gzip handle."""
+    compression = get_compression(file_path)
+    if compression == 'none':
+        return open(file_path, mode)
+    if compression == 'bgzf' and mode == 'rb' and seekable:
+        return BGZFReader(file_path)
+    return gzip.open(file_path, mode)
+
+class BGZFReader:
+    """Binary line reader for BGZF files.
+    Positions are BGZF virtual offsets: the compressed offset of a block shifted
+    left 16 bits plus the offset within the uncompressed block, as used by tabix."""
+    def __init__(self, file_path):
+        self.fh = open(file_path, 'rb')
+        self._load_block(0)
+
+    def _load_block(self, block_offset):
+        """Read and decompress the block that starts at the given compressed file offset."""
+        self.fh.seek(block_offset)
+        header = self.fh.read(12)
+        self._block_offset = block_offset
+        self._within_block = 0
+        if len(header) < 12:
+            self._block_data = b''
+            self._next_block_offset = block_offset
+            return
+        if not header.startswith(GZIP_MAGIC):
+            raise ValueError('Invalid BGZF block at offset {}'.format(block_offset))
+        extra_length = struct.unpack('<H', header[10:12])[0]
+        extra = self.fh.read(extra_length)
+        block_size = None
+        position = 0
+        while position < extra_length:
+            subfield_id = extra[position:position + 2]
+            subfield_length = struct.unpack('<H', extra[position + 2:position + 4])[0]
+            if subfield_id == b'BC':
+                block_size = struct.unpack('<H', extra[position + 4:position + 6])[0] + 1
+            position += 4 + subfield_length
+        if block_size is None:
+            raise ValueError('Missing BGZF block size at offset {}'.format(block_offset))
+        compressed_data = self.fh.read(block_size - 12 - extra_length - 8)
+        self.fh.read(8)
+        self._block_data = zlib.decompress(compressed_data, -15)
+        self._next_block_offset = block_offset + block_size
+
+    def tell(self):
+        """Return the virtual offset of the next byte to be read."""
+        if self._block_data and self._within_block == len(self._block_data):
+            return self._next_block_offset << 16
+        return (self._block_offset << 16) | self._within_block
+
+    def seek(self, virtual_offset):
+        """Move to the given virtual offset."""
+        block_offset, within_block = virtual_offset >> 16, virtual_offset & 0xFFFF
+        if block_offset != self._block_offset or not self._block_data:
+            self._load_block(block_offset)
+        self._within_block = within_block
+
+    def readline(self):
+        """Return the next line including its line ending, or b'' at the end of the file."""
+        pieces = []
+        while True:
+            if self._within_block >= len(self._block_data):
+                if self._next_block_offset == self._block_offset:
+                    break
+                self._load_block(self._next_block_offset)
+                continue
+            newline_index = self._block_data.find(b'\n', self._within_block)
+            if newline_index >= 0:
+                pieces.append(self._block_data[self._within_block:newline_index + 1])
+                self._within_block = newline_index + 1
+                break
+            pieces.append(self._block_data[self._within_block:])
+            self._within_block = len(self._block_data)
+        return b''.join(pieces)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def fileno(self):
+        return self.fh.fileno()
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_header_lines(fh):
+    """Read and return the header lines, including the #CHROM line, from a text handle or
+    a binary handle. Lines read from a binary handle are decoded with '\r\n' line endings
+    changed to '\n', as in text mode."""
+    header_lines = []
+    for line in fh:
+        if isinstance(line, bytes):
+            line = line.decode(VCF_ENCODING).replace('\r\n', '\n')
+        header_lines.append(line)
+        if line.startswith('#CHROM'):
+            break
+    return header_lines
+
+def _split_lines(text, maxsplit):
+    """Return the rows of a block of complete lines, see iter_block_rows."""
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if '"' not in text:
+        return [line.split('\t', maxsplit) for line in text.split('\n') if line]
+    rows = []
+    for line in text.split('\n'):
+        if not line:
+            continue
+        if '"' in line:
+            # csv.reader strips the quotes around quoted fields, keep the same rows
+            rows.append(next(csv.reader([line], delimiter='\t')))
+        else:
+            rows.append(line.split('\t', maxsplit))
+    return rows
+
+def _iter_row_blocks(fh, maxsplit, block_size):
+    """Yield a list of rows for each block read, see iter_block_rows."""
+    remainder = b''
+    while True:
+        block = fh.read(block_size)
+        if not block:
+            break
+        if remainder:
+            block = remainder + block
+        # Only decode whole lines so that multi-byte characters are never cut in two
+        last_newline_index = block.rfind(b'\n')
+        if last_newline_index < 0:
+            remainder = block
+            continue
+        remainder = block[last_newline_index + 1:]
+        yield _split_lines(block[:last_newline_index].decode(VCF_ENCODING), maxsplit)
+    if remainder:
+        yield _split_lines(remainder.decode(VCF_ENCODING), maxsplit)
+
+def iter_block_rows(fh, column_count=None, block_size=READ_BLOCK_SIZE):
+    """Return an iterator over the rows of the remaining lines of a binary handle, as lists
+    of column values, the same rows as csv.reader on a text handle gives for VCF data lines.
+    The file is read block_size bytes at a time and empty lines are skipped.
+    If column_count is given, rows are only split into that many columns, the last holding
+    the rest of the line, e.g. 9 to leave the FORMAT and sample columns unsplit. Lines with
+    quotes are always split fully, by csv.reader.
+    The columns before column_count are all split, including QUAL and FILTER, which most
+    sinks don't read: skipping them with a regex or by slicing costs more than the str.split
+    that creates them."""
+    maxsplit = column_count - 1 if column_count else -1
+    return chain.from_iterable(_iter_row_blocks(fh, maxsplit, block_size))
+
+def parse_region(region):
+    """Parse a region string 'chrom', 'chrom:start' or 'chrom:start-end' (1-based, inclusive,
+    commas allowed in the numbers) and return a (chrom, start, end) tuple. A missing end
+    means the end of the chromosome and is returned as None."""
+    chrom, _, interval = region.partition(':')
+    if not interval:
+        return chrom, 1, None
+    start, _, end = interval.replace(',', '').partition('-')
+    return chrom, int(start), int(end) if end else None
+
+class VCFIndex:
+    """Linear index over a position-sorted, uncompressed or BGZF compressed VCF.
+    For each chromosome it holds a list of [first_position, max_end, offset] entries in file
+    order where offset is the (virtual) offset of the first row covered by the entry and max_end
+    is the largest end position (POS + len(REF) - 1) of the rows it covers."""
+    def __init__(self, vcf_file_path, entries, compression, file_size, mtime):
+        self.vcf_file_path = vcf_file_path
+        self.entries = entries
+        self.compression = compression
+        self.file_size = file_size
+        self.mtime = mtime
+
+    @classmethod
+    def build(cls, vcf_file_path):
+        """Scan the VCF once and return a new index for it."""
+        compression = get_compression(vcf_file_path)
+        if compression == 'gzip':
+            raise ValueError('Region queries need an uncompressed or bgzip compressed VCF: {}'
+                                .format(vcf_file_path))
+        entries = {}
+        entry = None
+        with open_vcf(vcf_file_path, 'rb') as fh:
+            while True:
+                offset = fh.tell()
+                line = fh.readline()
+                if not line or line.startswith(b'#CHROM'):
+                    break
+            while True:
+                offset = fh.tell()
+                line = fh.readline()
+                if not line:
+                    break
+                chrom, pos, _, ref = line.split(b'\t', 4)[:4]
+                chrom, pos = chrom.decode(VCF_ENCODING), int(pos)
+                end = pos + len(ref) - 1
+                if compression == 'bgzf':
+                    new_span = entry is not None and offset >> 16 != entry[2] >> 16
+                else:
+                    new_span = entry is not None and offset - entry[2] >= INDEX_BYTE_SPAN
+                if entry is None or new_span or chrom != entry_chrom:
+                    entry_chrom = chrom
+                    entry = [pos, end, offset]
+                    entries.setdefault(chrom, []).append(entry)
+                elif end > entry[1]:
+                    entry[1] = end
+        file_stat = os.stat(vcf_file_path)
+        return cls(vcf_file_path, entries, compression, file_stat.st_size, file_stat.st_mtime)
+
+    def save(self, index_file_path=None):
+        """Write the index as JSON, by default next to the VCF file."""
+        index_file_path = index_file_path or self.vcf_file_path + INDEX_EXTENSION
+        index_map = {
+            'compression': self.compression,
+            'file_size': self.file_size,
+            'mtime': self.mtime,
+            'entries': self.entries}
+        with open(index_file_path, 'wt') as fho:
+            json.dump(index_map, fho)
+
+    @classmethod
+    def load(cls, vcf_file_path, index_file_path=None):
+        """Read a saved index. Return None if it doesn't exist or the VCF has changed since."""
+        index_file_path = index_file_path or vcf_file_path + INDEX_EXTENSION
+        if not os.path.isfile(index_file_path):
+            return None
+        with open(index_file_path) as fh:
+            index_map = json.load(fh)
+        file_stat = os.stat(vcf_file_path)
+        if index_map['file_size'] != file_stat.st_size or index_map['mtime'] != file_stat.st_mtime:
+            return None
+        return cls(vcf_file_path, index_map['entries'], index_map['compression'],
+                   index_map['file_size'], index_map['mtime'])
+
+    @classmethod
+    def load_or_build(cls, vcf_file_path):
+        """Return the saved index for the VCF, building and saving it first if needed.
+        If the index can't be saved, e.g. for a VCF in a read-only directory, the index
+        built in memory is used."""
+        vcf_index = cls.load(vcf_file_path)
+        if vcf_index is None:
+            vcf_index = cls.build(vcf_file_path)
+            try:
+                vcf_index.save()
+            except OSError:
+                pass
+        return vcf_index
+
+    def get_start_offset(self, chrom, start):
+        """Return the offset to start reading from for rows on chrom that may end at or
+        after start, or None if there are none."""
+        for first_position, max_end, offset in self.entries.get(chrom, []):
+            if max_end >= start:
+                return offset
+        return None
+
+def iter_region_lines(vcf_file_path, regions, vcf_index=None):
+    """Yield the decoded data lines overlapping each of the given region strings in turn.
+    Rows overlapping more than one region are yielded once per region."""
+    vcf_index = vcf_index or VCFIndex.load_or_build(vcf_file_path)
+    with open_vcf(vcf_file_path, 'rb') as fh:
+        for region in regions:
+            chrom, start, end = parse_region(region)
+            offset = vcf_index.get_start_offset(chrom, start)
+            if offset is None:
+                continue
+            fh.seek(offset)
+            for line in fh:
+                line_chrom, pos, _, ref = line.split(b'\t', 4)[:4]
+                pos = int(pos)
+                if line_chrom.decode(VCF_ENCODING) != chrom or (end is not None and pos > end):
+                    break
+                if pos + len(ref) - 1 >= start:
+                    yield line.decode(VCF_ENCODING)
+
+def iter_body_rows(vcf_file_path, regions=None, delimiter='\t'):
+    """Yield the VCF data rows, that is, those after the #CHROM line, as lists of column values.
+    If regions are given only the rows overlapping them are read, using the region index."""
+    if regions:
+        yield from csv.reader(iter_region_lines(vcf_file_path, regions), delimiter=delimiter)
+        return
+    with open_vcf(vcf_file_path) as fh:
+        csv_reader = csv.reader(fh, delimiter=delimiter)
+        for row in csv_reader:
+            if row[0].startswith('#CHROM'):
+                break
+        yield from csv_reader
@@ -1,5 +1,5 @@
 import os
-import re
+from vcf_header import VCFHeader
 
 class VCFMetaParser:
     """
@@ -12,33 +12,20 @@ class VCFMetaParser:
         self.vcf_file_path = vcf_file_path
         self.output_dir = output_dir
         self.info_properties = ['ID', 'Number', 'Type', 'Description']
+        self.vcf_header = VCFHeader.load_or_read(vcf_file_path)
         self.metadata_lines = self.get_metadata_lines()
 
     def get_metadata_lines(self):
         """Return a list of metadata lines, that is, those beginning with ##, in the VCF file"""
-        metadata_lines = []
-        with open(self.vcf_file_path, 'rt') as fh:
-            for line in fh:
-                if line.startswith('#CHROM'):
-                    break
-                elif line.startswith('##'):
-                    metadata_lines.append(line.strip(os.linesep))
-            return metadata_lines
+        return self.vcf_header.meta_lines
 
     def create_info_maps(self):
-        """Extract INFO metadata from the metadata lines and return them as a list of dictionaries"""
+        """Extract INFO metadata from the parsed header and return them as a list of dictionaries"""
         info_maps = []
-        info_lines = [md_line for md_line in self.metadata_lines 
-                        if md_line.startswith('##INFO=')]
-        for info_line in info_lines:
-            info_map = {}
-            for info_property in self.info_properties:
-                re_pat = '{}=([^,>"]*)'.format(info_property)
-                match = re.search(re_pat, info_line)
-                if match:
-                    info_val = match.group(1)
-                    info_map[info_property] = info_val
-            info_maps.append(info_map)
+        for info_definition in self.vcf_header.info.values():
+            info_maps.append({info_property: info_definition[info_property]
+                              for info_property in self.info_properties
+                              if info_property in info_definition})
         return info_maps
 
     def create_info_dict_list(self):
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+"""
+Optional instrumentation for the conversion pipeline: cumulative timers for the read (line
+reading and csv splitting), info_parse, format and write stages, row and byte counters,
+a periodic progress callback with throughput and ETA, and a JSON stats report.
+Pass a PipelineStats to VCFStream, VCF2TSV.write_outputs or
+VCFToFiles.write_variant_rows_to_files to turn it on. Without one the uninstrumented code
+runs unchanged.
+To keep the cost low enough to leave on in production runs, only one row in every
+sample_every is timed; the other rows run the uninstrumented code. Their wall time is
+measured as a whole and shared out between the stages in the proportions measured on the
+timed rows. Set sample_every to 1 to time every row.
+    stats = PipelineStats(progress_callback=print_progress)
+    VCF2TSV('calls.vcf').write_outputs(tab_file='calls.tsv', stats=stats)
+    stats.save_report('calls_stats.json')
+"""
+
+STAGES = ('read', 'info_parse', 'format', 'write')
+# Seconds between progress callbacks
+PROGRESS_INTERVAL = 10
+SAMPLE_EVERY = 64
+BYTES_PER_MB = 1024 * 1024
+
+def get_file_position(fh):
+    """Return the operating system read position of a file handle, that is, the number of
+    bytes read from the file on disk, compressed bytes for compressed files."""
+    return os.lseek(fh.fileno(), 0, os.SEEK_CUR)
+
+class PipelineStats:
+    """Collects stage timings and counters for one conversion run.
+    Stage times are exclusive: a timed function called from another timed function, such as
+    the INFO parsing done while formatting a row, is only counted in its own stage.
+    Time spent outside the stages, e.g. creating the SQLite indexes when a sink is closed,
+    is reported as other_seconds, as is the cost of the timers on the timed rows. Sharing
+    out the measured wall time of the untimed rows, rather than scaling the timed rows by the
+    number of rows, keeps the cost of the timers out of the stage times, so the stage times
+    and other_seconds add up to the elapsed time.
+    """
+    def __init__(self, progress_callback=None, progress_interval=PROGRESS_INTERVAL,
+                 sample_every=SAMPLE_EVERY):
+        """Optionally provide a function to call every progress_interval seconds with the
+        dictionary returned by get_progress, such as print_progress, and the number of rows
+        per timed row."""
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.sample_every = sample_every
+        # Seconds measured on every row or chunk, and on the timed rows only
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.sampled_stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.row_count = 0
+        self.sampled_row_count = 0
+        # Wall time of the timed rows, and of all the rows read in the sampled row loop
+        self.sampled_row_seconds = 0.0
+        self.row_seconds = 0.0
+        self.bytes_read = 0
+        self.total_bytes = None
+        self.start_time = None
+        self.end_time = None
+        self.get_position = None
+        self._start_position = 0
+        self._switches = []
+        self._nested_seconds = 0.0
+        self._next_progress_time = None
+
+    def start(self, total_bytes=None, get_position=None):
+        """Start the clock. get_position is a function returning the current input position
+        in bytes, used for the bytes read, and total_bytes the input size in the same units,
+        used for the fraction done and the ETA."""
+        self.get_position = get_position
+        if get_position is not None:
+            self._start_position = get_position()
+            if total_bytes is not None:
+                total_bytes -= self._start_position
+        self.total_bytes = total_bytes
+        self.start_time = time.perf_counter()
+        self._next_progress_time = self.start_time + self.progress_interval
+
+    def stop(self):
+        self.end_time = time.perf_counter()
+
+    def update_bytes_read(self):
+        """Set the bytes read from the input position, while the input is still open."""
+        if self.get_position is not None:
+            self.bytes_read = self.get_position() - self._start_position
+
+    def add(self, stage, seconds):
+        """Add seconds measured for all the rows to the cumulative time of a stage."""
+        self.stage_seconds[stage] += seconds
+
+    def add_row_seconds(self, sampled_row_seconds, row_seconds):
+        """Add the wall time of a timed row, including its timers, and that of the timed row
+        and the untimed rows read after it."""
+        self.sampled_row_seconds += sampled_row_seconds
+        self.row_seconds += row_seconds
+
+    def update(self, row_count, byte_count=0):
+        """Count rows and input bytes processed and call the progress callback if it is due."""
+        self.row_count += row_count
+        self.bytes_read += byte_count
+        if self.progress_callback and time.perf_counter() >= self._next_progress_time:
+            self.update_bytes_read()
+            self.report_progress()
+
+    def timed(self, stage, function):
+        """Return a wrapper of function that adds the time spent in it to the given stage,
+        less the time spent in any timed functions that it calls."""
+        perf_counter = time.perf_counter
+        stage_seconds = self.sampled_stage_seconds
+        def timed_function(*args):
+            outer_nested_seconds = self._nested_seconds
+            self._nested_seconds = 0.0
+            start = perf_counter()
+            result = function(*args)
+            elapsed = perf_counter() - start
+            stage_seconds[stage] += elapsed - self._nested_seconds
+            self._nested_seconds = outer_nested_seconds + elapsed
+            return result
+        return timed_function
+
+    def time_function(self, target, name, stage):
+        """Time the function in attribute name of target as the given stage by replacing it
+        with a timed wrapper while a row is sampled."""
+        function = getattr(target, name)
+        self._switches.append((target, name, function, self.timed(stage, function)))
+
+    def time_output_file(self, target, name):
+        """Time the write calls to the output file in attribute name of target as the write
+        stage, by replacing it with a TimedOutputFile while a row is sampled."""
+        fho = getattr(target, name)
+        self._switches.append((target, name, fho, TimedOutputFile(fho, self)))
+
+    def set_sampling(self, sampling):
+        """Turn the timers added with time_function and time_output_file on or off."""
+        for target, name, plain_value, timed_value in self._switches:
+            setattr(target, name, timed_value if sampling else plain_value)
+
+    def read_sampled_row(self, rows):
+        """Return the next row from a rows iterator, or None at the end, timing the read."""
+        start = time.perf_counter()
+        row = next(rows, None)
+        self.sampled_stage_seconds['read'] += time.perf_counter() - start
+        if row is not None:
+            self.sampled_row_count += 1
+        return row
+
+    def get_stage_seconds(self):
+        """Return a dictionary of the estimated cumulative seconds per stage: the seconds
+        measured on every row or chunk and on the timed rows, plus the wall time of the untimed
+        rows shared out in proportion to the stage times of the timed rows."""
+        sampled_seconds = sum(self.sampled_stage_seconds.values())
+        untimed_row_seconds = self.row_seconds - self.sampled_row_seconds
+        scale = 1 + untimed_row_seconds / sampled_seconds if sampled_seconds else 0
+        return {stage: self.stage_seconds[stage] + self.sampled_stage_seconds[stage] * scale
+                for stage in STAGES}
+
+    def get_progress(self):
+        """Return a dictionary with the rows and bytes read so far, the elapsed seconds,
+        the throughput and, if the input size is known, the fraction done and the ETA
+        in seconds."""
+        elapsed = (self.end_time or time.perf_counter()) - self.start_time
+        rows_per_s = mb_per_s = fraction_done = eta_seconds = None
+        if elapsed > 0:
+            rows_per_s = self.row_count / elapsed
+            if self.bytes_read or self.get_position is not None:
+                mb_per_s = self.bytes_read / BYTES_PER_MB / elapsed
+        if self.total_bytes:
+            fraction_done = min(self.bytes_read / self.total_bytes, 1.0)
+            if fraction_done:
+                eta_seconds = elapsed * (1 - fraction_done) / fraction_done
+        return {
+            'row_count': self.row_count,
+            'bytes_read': self.bytes_read,
+            'elapsed_seconds': elapsed,
+            'rows_per_s': rows_per_s,
+            'mb_per_s': mb_per_s,
+            'fraction_done': fraction_done,
+            'eta_seconds': eta_seconds}
+
+    def report_progress(self):
+        self._next_progress_time = time.perf_counter() + self.progress_interval
+        self.progress_callback(self.get_progress())
+
+    def get_report(self):
+        """Return the final stats as a JSON-serialisable dictionary."""
+        report = self.get_progress()
+        report.pop('eta_seconds')
+        stage_seconds = self.get_stage_seconds()
+        report['sampled_row_count'] = self.sampled_row_count
+        report['stage_seconds'] = stage_seconds
+        report['other_seconds'] = report['elapsed_seconds'] - sum(stage_seconds.values())
+        return report
+
+    def save_report(self, report_file):
+        """Write the final stats report to a JSON file."""
+        with open(report_file, 'wt') as fho:
+            json.dump(self.get_report(), fho, indent=2)
+
+class TimedOutputFile:
+    """Wraps an output file, timing its write calls as the write stage.
+    Other attributes are those of the wrapped file."""
+    def __init__(self, fho, stats):
+        self.fho = fho
+        self.write = stats.timed('write', fho.write)
+
+    def __getattr__(self, name):
+        return getattr(self.fho, name)
+
+def print_progress(progress, file=sys.stderr):
+    """Progress callback printing a one-line summary to standard error."""
+    message = '{:,} rows, {:,.0f} rows/s, {:.1f} MB/s'.format(
+        progress['row_count'], progress['rows_per_s'] or 0, progress['mb_per_s'] or 0)
+    if progress['fraction_done'] is not None:
+        message += ', {:.1%} done'.format(progress['fraction_done'])
+    if progress['eta_seconds'] is not None:
+        message += ', ETA {:.0f}s'.format(progress['eta_seconds'])
+    print(message, file=file, flush=True)
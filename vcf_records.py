@@ -0,0 +1,95 @@
+from vcf_stream import VCFStream
+from vcf_header import VCFHeader
+from vcf_info_parser import InfoParser
+try:
+    import numpy as np
+except ImportError:
+    np = None
+"""
+Streaming iterator API over the data rows of a VCF for library use, without going through
+output files. Records are small __slots__ objects and INFO is only decoded, for the requested
+fields, when the info attribute is first read, so memory use doesn't grow with the file size.
+    for variant in iter_variants('calls.vcf.gz', regions=['chr1:1-5000000'], info_fields=['AFR']):
+        print(variant.chrom, variant.pos, variant.info.get('AFR'))
+"""
+
+class VariantRecord:
+    """One VCF data row: chrom, pos (int), id, ref, alt, qual (float or None for '.'), filter
+    and info, a dictionary of typed INFO values (see InfoParser.parse) decoded on first use.
+    The undecoded INFO column value is available as info_value."""
+    __slots__ = ('chrom', 'pos', 'id', 'ref', 'alt', 'qual', 'filter', 'info_value',
+                 '_info', '_info_parser', '_info_fields')
+
+    def __init__(self, row, info_parser, info_fields=None):
+        self.chrom, pos, self.id, self.ref, self.alt, qual, self.filter, self.info_value = row[:8]
+        self.pos = int(pos)
+        self.qual = None if qual == '.' else float(qual)
+        self._info = None
+        self._info_parser = info_parser
+        self._info_fields = info_fields
+
+    @property
+    def info(self):
+        if self._info is None:
+            self._info = self._info_parser.parse(self.info_value, self._info_fields)
+        return self._info
+
+    def __repr__(self):
+        return 'VariantRecord({}:{} {} {}>{})'.format(self.chrom, self.pos, self.id, self.ref, self.alt)
+
+def iter_variants(vcf_file_path, regions=None, info_fields=None):
+    """Yield a VariantRecord for each data row of a plain or gzip/bgzip compressed VCF,
+    optionally restricted to regions such as ["chr1:1-5000000"]. If info_fields is given
+    only those INFO keys are decoded."""
+    if info_fields is not None:
+        info_fields = frozenset(info_fields)
+    info_parser = InfoParser.from_vcf_header(VCFHeader.load_or_read(vcf_file_path))
+    with VCFStream(vcf_file_path, regions).read_rows(needs_samples=False) as (header_lines, rows):
+        for row in rows:
+            yield VariantRecord(row, info_parser, info_fields)
+
+def _make_arrays(variants, info_fields):
+    """Return a dictionary of NumPy arrays, one per record attribute and requested INFO field."""
+    arrays = {
+        'chrom': np.array([variant.chrom for variant in variants], dtype=object),
+        'pos': np.array([variant.pos for variant in variants], dtype=np.int64),
+        'id': np.array([variant.id for variant in variants], dtype=object),
+        'ref': np.array([variant.ref for variant in variants], dtype=object),
+        'alt': np.array([variant.alt for variant in variants], dtype=object),
+        'qual': np.array([variant.qual for variant in variants], dtype=np.float64),
+        'filter': np.array([variant.filter for variant in variants], dtype=object)}
+    info_definitions = {info_definition['ID']: info_definition for info_definition
+                        in variants[0]._info_parser.info_definitions}
+    for info_field in info_fields or []:
+        info_definition = info_definitions.get(info_field, {})
+        values = [variant.info.get(info_field) for variant in variants]
+        if info_definition.get('Type') == 'Flag':
+            arrays[info_field] = np.array([value is True for value in values], dtype=bool)
+        elif (info_definition.get('Type') in ('Integer', 'Float')
+                and info_definition.get('Number') == '1'
+                and all(value is None or isinstance(value, (int, float)) for value in values)):
+            arrays[info_field] = np.array([np.nan if value is None else value for value in values],
+                                          dtype=np.float64)
+        else:
+            # Filled in rather than passed to np.array, which would make a 2-D array of lists
+            # that all have the same length
+            array = arrays[info_field] = np.empty(len(values), dtype=object)
+            array[:] = values
+    return arrays
+
+def iter_variant_batches(vcf_file_path, batch_size=10000, regions=None, info_fields=None,
+                         as_arrays=False):
+    """Yield lists of up to batch_size VariantRecords, see iter_variants. With as_arrays set,
+    yield dictionaries of NumPy arrays instead: int64 pos, float64 qual (NaN for '.'), object
+    arrays for the string columns and one array per requested INFO field: float64 with NaN
+    for missing for scalar Integer and Float fields, bool for flags and object otherwise."""
+    if as_arrays and np is None:
+        raise ImportError('iter_variant_batches with as_arrays requires numpy')
+    batch = []
+    for variant in iter_variants(vcf_file_path, regions, info_fields):
+        batch.append(variant)
+        if len(batch) == batch_size:
+            yield _make_arrays(batch, info_fields) if as_arrays else batch
+            batch = []
+    if batch:
+        yield _make_arrays(batch, info_fields) if as_arrays else batch
@@ -0,0 +1,260 @@
+import os
+import sqlite3
+from collections import OrderedDict
+from urllib.request import pathname2url
+"""
+Genomic range queries over a database loaded by VCFToSQLite or files2sqlite.sh, in either
+the default or the compact schema.
+create_region_index adds an end_position column, position plus the REF length less one,
+and a UCSC-style bin column to the variant table, so a region query only reads the bins
+that can hold overlapping variants and also finds deletions starting before the region.
+Each variant is put in the smallest bin of the 128 kb / 1 Mb / 8 Mb / 64 Mb / 512 Mb levels
+that contains its whole REF span.
+query_region and iter_region_batches then stream the variants overlapping a 1-based,
+inclusive region in position order, with their INFO values pivoted into a dictionary,
+in batches. Recently queried regions are kept in an LRU cache, so repeated lookups such as
+a genome browser panning back and forth don't go back to the database.
+    create_region_index('calls.db')
+    for variant in query_region('calls.db', '7', 117500000, 117700000, info_keys=['AFR', 'EUR']):
+        print(variant.pos, variant.id, variant.info.get('AFR'))
+"""
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Bin number of the first bin of each level, smallest bins first
+BIN_OFFSETS = (585, 73, 9, 1, 0)
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+MAX_POSITION = 2 ** 31 - 1
+BATCH_SIZE = 1000
+CACHE_SIZE = 128
+MAX_CACHED_ROWS = 100000
+
+def get_bin_ranges(start, end):
+    """Return a list of (first bin, last bin) ranges, one per level, of the bins that can
+    hold variants overlapping the 1-based, inclusive region start-end."""
+    start_bin = (start - 1) >> BIN_FIRST_SHIFT
+    end_bin = (end - 1) >> BIN_FIRST_SHIFT
+    bin_ranges = []
+    for bin_offset in BIN_OFFSETS[:-1]:
+        bin_ranges.append((bin_offset + start_bin, bin_offset + end_bin))
+        start_bin >>= BIN_NEXT_SHIFT
+        end_bin >>= BIN_NEXT_SHIFT
+    # Variants spanning 64 Mb boundaries, or beyond 512 Mb, all go in bin 0
+    bin_ranges.append((0, 0))
+    return bin_ranges
+
+def _is_compact(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'variant'"
+                        ).fetchone() is not None
+
+def _has_region_index(conn, variant_table):
+    return 'bin' in [column[1] for column in
+                     conn.execute('PRAGMA table_info({})'.format(variant_table))]
+
+def create_region_index(sqlite_db_path):
+    """Add the end_position and bin columns and their index to a loaded database, if it
+    doesn't have them already."""
+    conn = sqlite3.connect(sqlite_db_path, isolation_level=None)
+    try:
+        compact = _is_compact(conn)
+        if _has_region_index(conn, 'variant' if compact else 'variant_detail'):
+            return
+        sql_file_name = 'compact_region_index.sql' if compact else 'region_index.sql'
+        with open(os.path.join(SCRIPT_DIR, sql_file_name)) as fh:
+            region_index_sql = fh.read()
+        conn.executescript('BEGIN;' + region_index_sql + 'COMMIT;')
+    finally:
+        conn.close()
+
+class RegionVariant:
+    """A variant returned by a region query: chrom, pos, end (pos plus the REF length less
+    one), id, ref, alt and info, a dictionary of INFO key -> value, True for flags.
+    Variants may be shared with the region cache so they should not be modified."""
+    __slots__ = ('chrom', 'pos', 'end', 'id', 'ref', 'alt', 'info')
+
+    def __init__(self, chrom, pos, end, variant_id, ref, alt):
+        self.chrom = chrom
+        self.pos = pos
+        self.end = end
+        self.id = variant_id
+        self.ref = ref
+        self.alt = alt
+        self.info = {}
+
+    def __repr__(self):
+        return 'RegionVariant({}:{} {} {}>{})'.format(self.chrom, self.pos, self.id, self.ref, self.alt)
+
+class RegionQuery:
+    """Region queries over one database, opened read-only, with an LRU cache of the results
+    of the last cache_size regions of up to max_cached_rows variants each.
+    The cache is cleared when another connection changes the database.
+    """
+    def __init__(self, sqlite_db_path, cache_size=CACHE_SIZE, max_cached_rows=MAX_CACHED_ROWS):
+        self.sqlite_db_path = sqlite_db_path
+        self.cache_size = cache_size
+        self.max_cached_rows = max_cached_rows
+        if not os.path.exists(sqlite_db_path):
+            raise IOError('No such database: {}'.format(sqlite_db_path))
+        self.conn = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(sqlite_db_path))),
+                                    uri=True)
+        self.compact = _is_compact(self.conn)
+        variant_table = 'variant' if self.compact else 'variant_detail'
+        if not _has_region_index(self.conn, variant_table):
+            raise ValueError('{} has no region index, run create_region_index on it first'.format(
+                sqlite_db_path))
+        # Variants are selected with their rowid, which is also the variant key used by the
+        # INFO tables in the compact schema; the default schema's INFO tables use the ID.
+        # The unary + keeps SQLite from picking the (chromosome, position) index, which
+        # can only bound the scan by the region end, over the bin index.
+        variant_key = 'variant_rowid' if self.compact else 'rowid'
+        self.region_sql = '''SELECT {0}, chromosome, position, end_position, variant_id,
+                                    ref_allele, alt_allele FROM {1}
+                             WHERE chromosome = ? AND ({{}})
+                             AND +position <= ? AND +end_position >= ?
+                             ORDER BY position, {0}'''.format(variant_key, variant_table)
+        if self.compact:
+            self.info_key_names = dict(self.conn.execute('SELECT info_key_id, info_key FROM info_key'))
+            self.info_key_ids = {info_key: info_key_id for info_key_id, info_key
+                                 in self.info_key_names.items()}
+            self.info_sql = {
+                'num': 'SELECT variant_rowid, info_key_id, info_num_val FROM info_key_num_val WHERE variant_rowid IN ({})',
+                'str': 'SELECT variant_rowid, info_key_id, info_str_val FROM info_key_str_val WHERE variant_rowid IN ({})',
+                'flag': 'SELECT variant_rowid, info_key_id, 1 FROM info_flag WHERE variant_rowid IN ({})'}
+            self.info_key_column = 'info_key_id'
+        else:
+            self.info_sql = {
+                'num': 'SELECT variant_id, info_key, info_num_val FROM info_key_num_val WHERE variant_id IN ({})',
+                'str': 'SELECT variant_id, info_key, info_str_val FROM info_key_str_val WHERE variant_id IN ({})',
+                'flag': 'SELECT variant_id, info_flag, 1 FROM info_flag WHERE variant_id IN ({})'}
+            self.info_key_column = {'num': 'info_key', 'str': 'info_key', 'flag': 'info_flag'}
+        self.cache = OrderedDict()
+        self.data_version = self._get_data_version()
+
+    def _get_data_version(self):
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _get_info_filter(self, info_keys, table_key):
+        """Return the SQL condition and parameters restricting an INFO query to info_keys."""
+        if info_keys is None:
+            return '', []
+        if self.compact:
+            column = self.info_key_column
+            info_keys = [self.info_key_ids[info_key] for info_key in info_keys
+                         if info_key in self.info_key_ids]
+        else:
+            column = self.info_key_column[table_key]
+        return ' AND {} IN ({})'.format(column, ', '.join('?' * len(info_keys))), list(info_keys)
+
+    def _add_info(self, variants, info_keys):
+        """Fill in the info dictionaries of a batch of variants given as a dictionary of
+        variant key -> list of the variants with that key."""
+        variant_keys = list(variants)
+        placeholders = ', '.join('?' * len(variant_keys))
+        for table_key, info_sql in self.info_sql.items():
+            info_filter, info_filter_params = self._get_info_filter(info_keys, table_key)
+            for variant_key, info_key, info_val in self.conn.execute(
+                    info_sql.format(placeholders) + info_filter, variant_keys + info_filter_params):
+                if self.compact:
+                    info_key = self.info_key_names[info_key]
+                for variant in variants[variant_key]:
+                    variant.info[info_key] = True if table_key == 'flag' else info_val
+
+    def _iter_query_batches(self, chrom, start, end, info_keys, batch_size):
+        bin_ranges = get_bin_ranges(start, end)
+        bin_condition = ' OR '.join(['bin BETWEEN ? AND ?'] * len(bin_ranges))
+        params = [chrom] + [bin_bound for bin_range in bin_ranges for bin_bound in bin_range] + [end, start]
+        cursor = self.conn.execute(self.region_sql.format(bin_condition), params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            variants = [RegionVariant(*row[1:]) for row in rows]
+            # In the default schema, variants that share an ID share its INFO rows. Those
+            # without an ID, '.', get no INFO as their INFO rows can't be told apart.
+            variants_by_key = {}
+            for row, variant in zip(rows, variants):
+                if self.compact:
+                    variants_by_key.setdefault(row[0], []).append(variant)
+                elif variant.id != '.':
+                    variants_by_key.setdefault(variant.id, []).append(variant)
+            if variants_by_key:
+                self._add_info(variants_by_key, info_keys)
+            yield variants
+
+    def iter_batches(self, chrom, start=1, end=None, info_keys=None, batch_size=BATCH_SIZE):
+        """Yield lists of up to batch_size RegionVariants overlapping the 1-based, inclusive
+        region chrom:start-end, the whole chromosome if end is None, in position order.
+        If info_keys is given only those INFO keys are returned."""
+        if end is None:
+            end = MAX_POSITION
+        if info_keys is not None:
+            info_keys = tuple(info_keys)
+        data_version = self._get_data_version()
+        if data_version != self.data_version:
+            self.cache.clear()
+            self.data_version = data_version
+        cache_key = (chrom, start, end, info_keys)
+        cached_variants = self.cache.get(cache_key)
+        if cached_variants is not None:
+            self.cache.move_to_end(cache_key)
+            for batch_start in range(0, len(cached_variants), batch_size):
+                yield cached_variants[batch_start:batch_start + batch_size]
+            return
+        variants = []
+        for batch in self._iter_query_batches(chrom, start, end, info_keys, batch_size):
+            if variants is not None:
+                variants.extend(batch)
+                if len(variants) > self.max_cached_rows:
+                    variants = None
+            yield batch
+        if variants is not None and self.cache_size > 0:
+            self.cache[cache_key] = variants
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def query(self, chrom, start=1, end=None, info_keys=None, batch_size=BATCH_SIZE):
+        """Yield the RegionVariants of iter_batches one at a time."""
+        for batch in self.iter_batches(chrom, start, end, info_keys, batch_size):
+            for variant in batch:
+                yield variant
+
+    def close(self):
+        self.conn.close()
+
+# Database path -> RegionQuery, so that the region cache is kept between query_region calls
+_region_queries = {}
+
+def get_region_query(db):
+    """Return db if it is a RegionQuery, else the shared RegionQuery of the database path db."""
+    if isinstance(db, RegionQuery):
+        return db
+    sqlite_db_path = os.path.abspath(db)
+    region_query = _region_queries.get(sqlite_db_path)
+    if region_query is None:
+        region_query = _region_queries[sqlite_db_path] = RegionQuery(sqlite_db_path)
+    return region_query
+
+def iter_region_batches(db, chrom, start=1, end=None, info_keys=None, batch_size=BATCH_SIZE):
+    """Yield lists of RegionVariants overlapping a region of a database path or RegionQuery,
+    see RegionQuery.iter_batches."""
+    return get_region_query(db).iter_batches(chrom, start, end, info_keys, batch_size)
+
+def query_region(db, chrom, start=1, end=None, info_keys=None, batch_size=BATCH_SIZE):
+    """Yield the RegionVariants overlapping a region of a database path or RegionQuery,
+    fetched from the database batch_size at a time, see RegionQuery.iter_batches."""
+    return get_region_query(db).query(chrom, start, end, info_keys, batch_size)
+
+if __name__ == '__main__':
+    import sys
+    from vcf_io import parse_region
+    # Arguments: database path, then optionally a region such as 7:117500000-117700000 and
+    # INFO keys to print the overlapping variants
+    sqlite_db_path = sys.argv[1]
+    create_region_index(sqlite_db_path)
+    if len(sys.argv) > 2:
+        chrom, start, end = parse_region(sys.argv[2])
+        info_keys = sys.argv[3:] or None
+        for variant in query_region(sqlite_db_path, chrom, start, end, info_keys):
+            print('\t'.join([variant.chrom, str(variant.pos), variant.id, variant.ref, variant.alt,
+                             ';'.join('{}={}'.format(info_key, info_val)
+                                      for info_key, info_val in variant.info.items())]))
@@ -0,0 +1,397 @@
+import io
+import os
+import csv
+import json
+import time
+import queue
+import threading
+import contextlib
+from itertools import islice
+from vcf_io import open_vcf, iter_body_rows, iter_block_rows, read_header_lines, VCF_ENCODING
+from vcf_header import VCFHeader
+from vcf_profile import get_file_position
+"""
+Single-pass streaming engine for VCF conversion. The VCF is read once and every parsed data
+row is passed to each registered sink, so any mix of outputs (header file, body TSV,
+INFO-as-columns TSV, INFO-as-JSON TSV, the VCFToFiles key/val/flag files and SQLite) costs
+one read of the input.
+Long conversions can be checkpointed: the input offset, row count and output file sizes are
+recorded periodically in a sidecar file and a re-run after the process is killed truncates
+the outputs to the last checkpoint and continues from there.
+Runs can also be instrumented with a vcf_profile.PipelineStats for stage timings and progress.
+Whole-file runs read the VCF with the vcf_io.iter_block_rows fast path. Output files opened
+with open_output_file are written in large blocks by a BackgroundFileWriter thread on
+machines with more than one CPU, so parsing and formatting overlap with the disk writes.
+"""
+
+# Seconds between checkpoints and the number of rows between checks of the clock
+CHECKPOINT_INTERVAL = 30
+CHECKPOINT_CHECK_ROWS = 4096
+# Bytes buffered by the output files before they are written, and the number of such blocks
+# that can wait for the writer thread. With a single CPU a writer thread can't overlap with
+# anything, so the output files write directly.
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+OUTPUT_QUEUE_SIZE = 4
+BACKGROUND_WRITES = (os.cpu_count() or 1) > 1
+# VCF columns up to and including INFO
+FIXED_COLUMN_COUNT = 8
+
+class VCFStream:
+    """Read a VCF file once and feed its header lines and data rows to a set of sinks.
+    A sink is any object with the three methods:
+        open(header_lines): called once with the list of header lines up to and including #CHROM
+        write_row(row): called for each data row, given as a list of column values
+        close(): called once after the last row
+    Sinks with a needs_rows attribute set to False only use the header; if all the sinks are
+    like that the data rows aren't read at all. Sinks with a needs_samples attribute set to
+    False only use the first eight columns, CHROM to INFO; if all the sinks that use the rows
+    are like that, the FORMAT and sample columns are left unsplit in a ninth column.
+    Checkpointing needs two more methods on every sink:
+        checkpoint(): flush the output to disk and return a JSON-serialisable state, such as
+            the output file sizes
+        resume(header_lines, state): called instead of open when continuing from a checkpoint
+            with the state returned by checkpoint
+    For instrumented runs, sinks may have an instrument(stats) method that is called after
+    open or resume to register timers for their INFO parsing and writing with
+    stats.time_function and stats.time_output_file; the rest of write_row is timed as the
+    format stage.
+    """
+    def __init__(self, vcf_file_path, regions=None, checkpoint_path=None,
+                 checkpoint_interval=CHECKPOINT_INTERVAL, stats=None):
+        """Provide a path to a plain or gzip/bgzip compressed VCF file and an optional list of
+        regions such as ["chr1:1-5000000"] to restrict the data rows to.
+        Give a checkpoint_path to record a checkpoint every checkpoint_interval seconds and
+        to resume from the checkpoint there, if any. The checkpoint file is removed once the
+        run completes. Checkpointing reads the whole file so can't be combined with regions.
+        Give a vcf_profile.PipelineStats as stats to instrument the run."""
+        self.vcf_file_path = vcf_file_path
+        self.regions = regions
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.stats = stats
+        self.sinks = []
+        self.input_file = None
+        if checkpoint_path and regions:
+            raise ValueError('Checkpointing is not supported for region-restricted runs')
+
+    def add_sink(self, sink):
+        """Register a sink and return it."""
+        self.sinks.append(sink)
+        return sink
+
+    def _write_rows(self, rows, row_writers):
+        """Pass each row to all the row writers. Return the number of rows."""
+        row_count = 0
+        if len(row_writers) == 1:
+            write_row = row_writers[0]
+            for row in rows:
+                write_row(row)
+                row_count += 1
+        else:
+            for row in rows:
+                for write_row in row_writers:
+                    write_row(row)
+                row_count += 1
+        return row_count
+
+    def _instrument(self, fh):
+        """Start the stats clock and let the sinks register their timers. fh is the input
+        file handle; its position gives the bytes read unless the rows are read by region."""
+        if self.regions:
+            self.stats.start()
+        else:
+            self.stats.start(os.path.getsize(self.vcf_file_path), lambda: get_file_position(fh))
+        for sink in self.sinks:
+            if hasattr(sink, 'instrument'):
+                sink.instrument(self.stats)
+
+    def _write_rows_instrumented(self, rows, row_writers):
+        """Pass each row to all the row writers, timing one row in every stats.sample_every.
+        Return the number of rows."""
+        stats = self.stats
+        untimed_row_count = stats.sample_every - 1
+        timed_row_writers = [stats.timed('format', write_row) for write_row in row_writers]
+        perf_counter = time.perf_counter
+        rows = iter(rows)
+        row_count = 0
+        while True:
+            start = perf_counter()
+            row = stats.read_sampled_row(rows)
+            if row is None:
+                read_seconds = perf_counter() - start
+                stats.add_row_seconds(read_seconds, read_seconds)
+                break
+            stats.set_sampling(True)
+            for write_row in timed_row_writers:
+                write_row(row)
+            stats.set_sampling(False)
+            sampled_end = perf_counter()
+            batch_row_count = self._write_rows(islice(rows, untimed_row_count), row_writers)
+            stats.add_row_seconds(sampled_end - start, perf_counter() - start)
+            stats.update(1 + batch_row_count)
+            row_count += 1 + batch_row_count
+            if batch_row_count < untimed_row_count:
+                break
+        stats.update_bytes_read()
+        return row_count
+
+    @contextlib.contextmanager
+    def read_rows(self, needs_samples=True):
+        """Context manager opening the VCF and returning a (header_lines, rows) tuple where
+        rows iterates over the data rows, as lists of column values, restricted to the regions
+        if any were given. This is the reading core shared by run and vcf_records.iter_variants.
+        With needs_samples set to False, whole-file rows have the FORMAT and sample columns
+        left unsplit in a ninth column.
+        The header lines come from the VCFHeader cache and the read starts at its data offset."""
+        vcf_header = VCFHeader.load_or_read(self.vcf_file_path)
+        header_lines = vcf_header.header_lines
+        with open_vcf(self.vcf_file_path, 'rb', seekable=False) as fh:
+            self.input_file = fh
+            fh.seek(vcf_header.data_offset)
+            if self.regions:
+                rows = iter_body_rows(self.vcf_file_path, self.regions)
+            else:
+                rows = iter_block_rows(fh, None if needs_samples else FIXED_COLUMN_COUNT + 1)
+            yield header_lines, rows
+
+    def _get_needs_samples(self):
+        """Return whether any sink that uses the data rows needs the sample columns split."""
+        return any(getattr(sink, 'needs_samples', True) for sink in self.sinks
+                   if getattr(sink, 'needs_rows', True))
+
+    def run(self):
+        """Stream the VCF through all the registered sinks. Return the number of data rows."""
+        if self.checkpoint_path:
+            return self._run_with_checkpoints()
+        with self.read_rows(self._get_needs_samples()) as (header_lines, rows):
+            for sink in self.sinks:
+                sink.open(header_lines)
+            row_sinks = [sink for sink in self.sinks if getattr(sink, 'needs_rows', True)]
+            if not row_sinks:
+                rows = []
+            row_writers = [sink.write_row for sink in row_sinks]
+            if self.stats is None:
+                row_count = self._write_rows(rows, row_writers)
+            else:
+                self._instrument(self.input_file)
+                row_count = self._write_rows_instrumented(rows, row_writers)
+        for sink in self.sinks:
+            sink.close()
+        if self.stats is not None:
+            self.stats.stop()
+        return row_count
+
+    def _get_input_stat(self):
+        file_stat = os.stat(self.vcf_file_path)
+        return {'file_size': file_stat.st_size, 'mtime': file_stat.st_mtime}
+
+    def load_checkpoint(self):
+        """Return the saved checkpoint, or None if there is none or it was made for a different
+        version of the input file."""
+        if not os.path.isfile(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as fh:
+            checkpoint = json.load(fh)
+        if checkpoint['input'] != self._get_input_stat():
+            return None
+        if len(checkpoint['sink_states']) != len(self.sinks):
+            raise ValueError('Checkpoint {} was made with {} sinks, not {}'.format(
+                self.checkpoint_path, len(checkpoint['sink_states']), len(self.sinks)))
+        return checkpoint
+
+    def save_checkpoint(self, input_offset, row_count):
+        """Flush the sinks and atomically replace the checkpoint file."""
+        checkpoint = {
+            'input': self._get_input_stat(),
+            'input_offset': input_offset,
+            'row_count': row_count,
+            'sink_states': [sink.checkpoint() for sink in self.sinks]}
+        temp_checkpoint_path = self.checkpoint_path + '.tmp'
+        with open(temp_checkpoint_path, 'wt') as fho:
+            json.dump(checkpoint, fho)
+            fho.flush()
+            os.fsync(fho.fileno())
+        os.replace(temp_checkpoint_path, self.checkpoint_path)
+
+    def _iter_decoded_lines(self, fh):
+        for line in fh:
+            yield line.decode(VCF_ENCODING)
+
+    def _run_with_checkpoints(self):
+        """Run, reading the VCF in binary mode so that the offset of the next row is known
+        at each checkpoint."""
+        for sink in self.sinks:
+            if not hasattr(sink, 'checkpoint'):
+                raise ValueError('{} does not support checkpointing'.format(type(sink).__name__))
+        checkpoint = self.load_checkpoint()
+        with open_vcf(self.vcf_file_path, 'rb') as fh:
+            header_lines = read_header_lines(fh)
+            if checkpoint:
+                for sink, sink_state in zip(self.sinks, checkpoint['sink_states']):
+                    sink.resume(header_lines, sink_state)
+                fh.seek(checkpoint['input_offset'])
+                row_count = checkpoint['row_count']
+            else:
+                for sink in self.sinks:
+                    sink.open(header_lines)
+                row_count = 0
+            row_writers = [sink.write_row for sink in self.sinks
+                            if getattr(sink, 'needs_rows', True)]
+            rows = csv.reader(self._iter_decoded_lines(fh), delimiter='\t')
+            write_rows = self._write_rows
+            if self.stats is not None:
+                self._instrument(fh)
+                write_rows = self._write_rows_instrumented
+            next_checkpoint_time = time.monotonic() + self.checkpoint_interval
+            while True:
+                batch_row_count = write_rows(
+                    (row for _, row in zip(range(CHECKPOINT_CHECK_ROWS), rows)), row_writers)
+                row_count += batch_row_count
+                if batch_row_count < CHECKPOINT_CHECK_ROWS:
+                    break
+                if time.monotonic() >= next_checkpoint_time:
+                    self.save_checkpoint(fh.tell(), row_count)
+                    next_checkpoint_time = time.monotonic() + self.checkpoint_interval
+        for sink in self.sinks:
+            sink.close()
+        if self.stats is not None:
+            self.stats.stop()
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return row_count
+
+class BackgroundFileWriter(io.RawIOBase):
+    """Raw binary output file whose writes are done by a background thread, so the caller
+    goes on formatting rows while the disk write runs. Each write is queued, up to
+    OUTPUT_QUEUE_SIZE of them; wrap it in a large io.BufferedWriter so that they are few and
+    big. flush waits for the queued writes. Errors in the writer thread are raised by the
+    next write, flush or close.
+    """
+    def __init__(self, output_file, mode='wb'):
+        """Provide the output file path and the binary mode to open it in, 'wb' or 'ab'."""
+        super().__init__()
+        self.fho = open(output_file, mode, buffering=0)
+        self.error = None
+        self.blocks = queue.Queue(OUTPUT_QUEUE_SIZE)
+        self.writer_thread = threading.Thread(target=self._write_blocks, daemon=True)
+        self.writer_thread.start()
+
+    def _write_blocks(self):
+        """Writer thread loop: write each queued block until None is queued."""
+        while True:
+            block = self.blocks.get()
+            try:
+                if block is None:
+                    return
+                if self.error is None:
+                    self.fho.write(block)
+            except OSError as error:
+                self.error = error
+            finally:
+                self.blocks.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def writable(self):
+        return True
+
+    def write(self, block):
+        self._raise_error()
+        # The buffer passed in is reused by the caller, so queue a copy
+        self.blocks.put(bytes(block))
+        return len(block)
+
+    def flush(self):
+        """Wait until the queued writes are done."""
+        if not self.closed:
+            self.blocks.join()
+            self._raise_error()
+
+    def fileno(self):
+        return self.fho.fileno()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.blocks.put(None)
+            self.writer_thread.join()
+            self.fho.close()
+            super().close()
+
+class OutputFile(io.TextIOWrapper):
+    """Text output file whose flush also flushes its raw file, so that it waits for the
+    writes queued by a BackgroundFileWriter."""
+    def flush(self):
+        super().flush()
+        self.buffer.raw.flush()
+
+def open_output_file(output_file, resume_size=None):
+    """Open a text output file for writing in blocks of OUTPUT_BUFFER_SIZE bytes, written
+    in the background by a BackgroundFileWriter if BACKGROUND_WRITES is set. If resuming
+    from a checkpoint, truncate the file to the checkpointed resume_size and open it for
+    appending instead."""
+    mode = 'wb'
+    if resume_size is not None:
+        with open(output_file, 'r+b') as fh:
+            fh.truncate(resume_size)
+        mode = 'ab'
+    if BACKGROUND_WRITES:
+        raw_file = BackgroundFileWriter(output_file, mode)
+    else:
+        raw_file = open(output_file, mode, buffering=0)
+    return OutputFile(io.BufferedWriter(raw_file, OUTPUT_BUFFER_SIZE))
+
+def get_output_file_size(fho):
+    """Flush an output file to disk and return its size, for sink checkpoint states."""
+    fho.flush()
+    os.fsync(fho.fileno())
+    return os.fstat(fho.fileno()).st_size
+
+class HeaderFileSink:
+    """Sink that writes the header lines, that is, those beginning with ##, to a file."""
+    needs_rows = False
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+
+    def open(self, header_lines):
+        with open(self.output_file, 'wt') as fho:
+            for line in header_lines:
+                if line.startswith('#CHROM'): break
+                fho.write(line)
+
+    def write_row(self, row):
+        pass
+
+    def close(self):
+        pass
+
+    def checkpoint(self):
+        return None
+
+    def resume(self, header_lines, state):
+        self.open(header_lines)
+
+if __name__ == '__main__':
+    import sys
+    from vcf2tsv import VCF2TSV
+    from vcf_to_files import VCFToFiles, VariantFilesSink
+    from vcf_to_sqlite import VCFToSQLite
+    # Produce every output from a single read of the VCF
+    vcf_file_path = sys.argv[1]
+    dir_path = sys.argv[2]
+    vcf_stream = VCFStream(vcf_file_path)
+    vcf2tsv = VCF2TSV(vcf_file_path)
+    vcf2tsv.add_output_sinks(vcf_stream,
+                             header_file=os.path.join(dir_path, 'vcf_header.txt'),
+                             body_file=os.path.join(dir_path, 'vcf_body.tsv'),
+                             tab_file=os.path.join(dir_path, 'parsed_vcf_info_tabs.tsv'),
+                             json_file=os.path.join(dir_path, 'parsed_vcf_info_json.tsv'))
+    vcf_stream.add_sink(VariantFilesSink(VCFToFiles(vcf_file_path, dir_path)))
+    vcf_stream.add_sink(VCFToSQLite(vcf_file_path, os.path.join(dir_path, 'vcf.db')))
+    print(vcf_stream.run())
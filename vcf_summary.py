@@ -0,0 +1,290 @@
+import os
+import json
+import math
+import sqlite3
+from collections import Counter, defaultdict
+from vcf_info_parser import InfoParser, NUMERIC_PATTERN
+try:
+    import numpy as np
+except ImportError:
+    np = None
+"""
+Summary statistics gathered while a VCF is converted, so that the usual questions after a
+load don't need full scans of info_key_num_val and info_flag:
+    variants per chromosome
+    count, min, max, mean and a histogram of the values of each numeric INFO key, that is,
+        the values with the 'num' datatype of InfoParser.split and the numbers in the lists,
+        such as AF=0.1,0.2, of keys declared Integer or Float
+    the number and fraction of variants with each INFO flag
+A VCFSummary is a mergeable accumulator: summaries of separate chunks of a VCF, such as those
+parsed by the VCFToFiles process pool, are combined with merge. The histogram bins don't
+depend on the data so the bins of different chunks line up: 0.05 wide bins for values from 0
+up to 1, such as allele frequencies, and one bin per power of ten outside that range.
+A summary is saved as a JSON sidecar or as the summary tables in summary_ddl.sql and read
+back with VCFSummary.load or VCFSummary.from_sqlite:
+    VCFToSQLite('calls.vcf', 'calls.db', summary=True).load()
+    summary = VCFSummary.from_sqlite('calls.db')
+    summary.chromosome_counts['7'], summary.get_numeric_summary('AF')['mean'],
+    summary.get_flag_frequency('DB')
+"""
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Number of histogram bins between 0 and 1
+UNIT_HISTOGRAM_BINS = 20
+# Rows buffered before the values are added to the statistics in bulk
+SUMMARY_BUFFER_ROWS = 65536
+
+def get_histogram_bin(value):
+    """Return the start of the histogram bin of a value: value rounded down to a multiple of
+    1 / UNIT_HISTOGRAM_BINS from 0 up to 1, the power of ten at or below it from 1 up and
+    minus the power of ten at or above its magnitude below 0."""
+    if 0 <= value < 1:
+        return math.floor(value * UNIT_HISTOGRAM_BINS) / UNIT_HISTOGRAM_BINS
+    if value >= 1:
+        return 10.0 ** math.floor(math.log10(value))
+    return -10.0 ** math.ceil(math.log10(-value))
+
+def _count_histogram_bins(values):
+    """Return a Counter of histogram bin start -> number of values."""
+    if np is None:
+        return Counter(map(get_histogram_bin, values))
+    values = np.array(values, dtype=np.float64)
+    bin_starts = np.floor(values * UNIT_HISTOGRAM_BINS) / UNIT_HISTOGRAM_BINS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitudes = np.log10(np.abs(values))
+    high = values >= 1
+    bin_starts[high] = 10.0 ** np.floor(magnitudes[high])
+    negative = values < 0
+    bin_starts[negative] = -10.0 ** np.ceil(magnitudes[negative])
+    bin_starts, counts = np.unique(bin_starts, return_counts=True)
+    return Counter(dict(zip(bin_starts.tolist(), counts.tolist())))
+
+class VCFSummary:
+    """Mergeable summary statistics of the data rows of a VCF.
+    variant_count: the number of variants added
+    chromosome_counts: chromosome -> number of variants
+    numeric_stats: INFO key -> [value count, min, max, sum] of its numeric values
+    histograms: INFO key -> Counter of histogram bin start -> number of values
+    flag_counts: INFO flag -> number of variants with the flag
+    Values are buffered by add, so read the statistics after flush, which to_map, merge and
+    the readers call.
+    """
+    def __init__(self):
+        self.variant_count = 0
+        self.chromosome_counts = Counter()
+        self.numeric_stats = {}
+        self.histograms = {}
+        self.flag_counts = Counter()
+        self._chromosomes = []
+        self._numeric_values = defaultdict(list)
+        self._flags = []
+
+    def add(self, chrom, info_keys_vals, info_flags, numeric_info_ids=()):
+        """Add a variant given its chromosome and its split INFO column as returned by
+        InfoParser.split. The numbers in the 'str' values of the keys in numeric_info_ids,
+        the InfoParser attribute, are added one by one, skipping '.' and other non-numbers."""
+        self._chromosomes.append(chrom)
+        numeric_values = self._numeric_values
+        for info_key, info_val, datatype in info_keys_vals:
+            if datatype == 'num':
+                numeric_values[info_key].append(info_val)
+            elif info_key in numeric_info_ids:
+                numeric_values[info_key].extend(
+                    element for element in info_val.split(',') if NUMERIC_PATTERN.fullmatch(element))
+        self._flags.extend(info_flags)
+        if len(self._chromosomes) >= SUMMARY_BUFFER_ROWS:
+            self.flush()
+
+    def flush(self):
+        """Add the buffered values to the statistics."""
+        self.variant_count += len(self._chromosomes)
+        self.chromosome_counts.update(self._chromosomes)
+        numeric_values = self._numeric_values
+        for info_key, values in numeric_values.items():
+            values = list(map(float, values))
+            min_val, max_val = min(values), max(values)
+            # Numbers too large for a float, such as 1e400, are left out
+            if math.isinf(min_val) or math.isinf(max_val):
+                values = [value for value in values if not math.isinf(value)]
+                if not values:
+                    continue
+                min_val, max_val = min(values), max(values)
+            stats = self.numeric_stats.get(info_key)
+            if stats is None:
+                stats = self.numeric_stats[info_key] = [0, values[0], values[0], 0.0]
+                self.histograms[info_key] = Counter()
+            stats[0] += len(values)
+            stats[1] = min(stats[1], min_val)
+            stats[2] = max(stats[2], max_val)
+            stats[3] += math.fsum(values)
+            self.histograms[info_key].update(_count_histogram_bins(values))
+        self.flag_counts.update(self._flags)
+        # INFO columns of '.' are split into a '.' flag
+        self.flag_counts.pop('.', None)
+        self._chromosomes = []
+        self._numeric_values = defaultdict(list)
+        self._flags = []
+
+    def merge(self, other):
+        """Add the statistics of another summary to this one and return this one."""
+        self.flush()
+        other.flush()
+        self.variant_count += other.variant_count
+        self.chromosome_counts.update(other.chromosome_counts)
+        for info_key, (value_count, min_val, max_val, sum_val) in other.numeric_stats.items():
+            stats = self.numeric_stats.get(info_key)
+            if stats is None:
+                self.numeric_stats[info_key] = [value_count, min_val, max_val, sum_val]
+                self.histograms[info_key] = Counter(other.histograms[info_key])
+                continue
+            stats[0] += value_count
+            stats[1] = min(stats[1], min_val)
+            stats[2] = max(stats[2], max_val)
+            stats[3] += sum_val
+            self.histograms[info_key].update(other.histograms[info_key])
+        self.flag_counts.update(other.flag_counts)
+        return self
+
+    def get_numeric_summary(self, info_key):
+        """Return a dictionary with the count, min, max and mean of the numeric values of an
+        INFO key and its histogram as a list of (bin start, count) tuples in bin order, or
+        None if the key has no numeric values."""
+        self.flush()
+        if info_key not in self.numeric_stats:
+            return None
+        value_count, min_val, max_val, sum_val = self.numeric_stats[info_key]
+        return {'count': value_count, 'min': min_val, 'max': max_val, 'mean': sum_val / value_count,
+                'histogram': sorted(self.histograms[info_key].items())}
+
+    def get_flag_frequency(self, info_flag):
+        """Return the fraction of the variants that have an INFO flag."""
+        self.flush()
+        if not self.variant_count:
+            return 0.0
+        return self.flag_counts.get(info_flag, 0) / self.variant_count
+
+    def to_map(self):
+        """Return the statistics as a JSON-serialisable dictionary."""
+        self.flush()
+        return {
+            'variant_count': self.variant_count,
+            'chromosome_counts': dict(self.chromosome_counts),
+            'numeric_stats': {info_key: {'count': value_count, 'min': min_val, 'max': max_val,
+                                         'sum': sum_val, 'mean': sum_val / value_count,
+                                         'histogram': sorted(self.histograms[info_key].items())}
+                              for info_key, (value_count, min_val, max_val, sum_val)
+                              in self.numeric_stats.items()},
+            'flag_counts': dict(self.flag_counts)}
+
+    @classmethod
+    def from_map(cls, summary_map):
+        """Return a summary from a dictionary returned by to_map."""
+        summary = cls()
+        summary.variant_count = summary_map['variant_count']
+        summary.chromosome_counts.update(summary_map['chromosome_counts'])
+        for info_key, stats in summary_map['numeric_stats'].items():
+            summary.numeric_stats[info_key] = [stats['count'], stats['min'], stats['max'], stats['sum']]
+            summary.histograms[info_key] = Counter(dict(map(tuple, stats['histogram'])))
+        summary.flag_counts.update(summary_map['flag_counts'])
+        return summary
+
+    def save(self, summary_file_path):
+        """Write the statistics to a JSON file."""
+        with open(summary_file_path, 'wt') as fho:
+            json.dump(self.to_map(), fho)
+
+    @classmethod
+    def load(cls, summary_file_path):
+        """Read a summary saved as JSON."""
+        with open(summary_file_path) as fh:
+            return cls.from_map(json.load(fh))
+
+    def write_tables(self, conn):
+        """Replace the summary tables of an SQLite database with these statistics. Creating the
+        tables commits any open transaction on the connection."""
+        self.flush()
+        with open(os.path.join(SCRIPT_DIR, 'summary_ddl.sql')) as fh:
+            conn.executescript(fh.read())
+        conn.execute('INSERT INTO summary_variant(variant_count) VALUES(?)', (self.variant_count,))
+        conn.executemany('INSERT INTO summary_chromosome(chromosome, variant_count) VALUES(?, ?)',
+                         self.chromosome_counts.items())
+        conn.executemany('''INSERT INTO summary_info_num(info_key, value_count, min_val, max_val,
+                            sum_val, mean_val) VALUES(?, ?, ?, ?, ?, ?)''',
+                         [(info_key, value_count, min_val, max_val, sum_val, sum_val / value_count)
+                          for info_key, (value_count, min_val, max_val, sum_val)
+                          in self.numeric_stats.items()])
+        conn.executemany('''INSERT INTO summary_info_num_histogram(info_key, bin_start, bin_count)
+                            VALUES(?, ?, ?)''',
+                         [(info_key, bin_start, bin_count)
+                          for info_key, histogram in self.histograms.items()
+                          for bin_start, bin_count in histogram.items()])
+        conn.executemany('INSERT INTO summary_info_flag(info_key, variant_count) VALUES(?, ?)',
+                         self.flag_counts.items())
+
+    @classmethod
+    def from_sqlite(cls, sqlite_db_path):
+        """Read the summary tables of an SQLite database."""
+        conn = sqlite3.connect(sqlite_db_path)
+        try:
+            summary = cls()
+            summary.variant_count = conn.execute('SELECT variant_count FROM summary_variant').fetchone()[0]
+            summary.chromosome_counts.update(dict(conn.execute(
+                'SELECT chromosome, variant_count FROM summary_chromosome')))
+            for info_key, value_count, min_val, max_val, sum_val in conn.execute(
+                    'SELECT info_key, value_count, min_val, max_val, sum_val FROM summary_info_num'):
+                summary.numeric_stats[info_key] = [value_count, min_val, max_val, sum_val]
+                summary.histograms[info_key] = Counter()
+            for info_key, bin_start, bin_count in conn.execute(
+                    'SELECT info_key, bin_start, bin_count FROM summary_info_num_histogram'):
+                summary.histograms[info_key][bin_start] = bin_count
+            summary.flag_counts.update(dict(conn.execute(
+                'SELECT info_key, variant_count FROM summary_info_flag')))
+            return summary
+        finally:
+            conn.close()
+
+class SummarySink:
+    """VCFStream sink writing the VCFSummary of the data rows to a JSON file, for runs that
+    don't go through VCFToFiles or VCFToSQLite, which can gather the summary themselves."""
+    needs_samples = False
+
+    def __init__(self, summary_file_path):
+        self.summary_file_path = summary_file_path
+
+    def open(self, header_lines):
+        self.resume(header_lines, None)
+
+    def resume(self, header_lines, state):
+        info_parser = InfoParser.from_header_lines(header_lines)
+        self.split_info = info_parser.split
+        self.numeric_info_ids = info_parser.numeric_info_ids
+        self.summary = VCFSummary.from_map(state) if state else VCFSummary()
+
+    def checkpoint(self):
+        return self.summary.to_map()
+
+    def instrument(self, stats):
+        stats.time_function(self, 'split_info', 'info_parse')
+
+    def write_row(self, row):
+        info_keys_vals, info_flags = self.split_info(row[7])
+        self.summary.add(row[0], info_keys_vals, info_flags, self.numeric_info_ids)
+
+    def close(self):
+        self.summary.save(self.summary_file_path)
+
+if __name__ == '__main__':
+    import sys
+    from pprint import pprint
+    from vcf_stream import VCFStream
+    # Arguments: a VCF to summarise and the JSON file to write, or a JSON or SQLite summary
+    # to print
+    if len(sys.argv) > 2:
+        vcf_stream = VCFStream(sys.argv[1])
+        vcf_stream.add_sink(SummarySink(sys.argv[2]))
+        vcf_stream.run()
+        pprint(VCFSummary.load(sys.argv[2]).to_map())
+    elif sys.argv[1].endswith('.json'):
+        pprint(VCFSummary.load(sys.argv[1]).to_map())
+    else:
+        pprint(VCFSummary.from_sqlite(sys.argv[1]).to_map())
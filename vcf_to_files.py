@@ -1,38 +1,94 @@
 import os
-import csv
+import io
+import time
+import multiprocessing
+from vcf_io import get_compression, strip_vcf_extension, iter_body_rows, iter_block_rows
+from vcf_header import VCFHeader
+from vcf_stream import (VCFStream, HeaderFileSink, open_output_file, get_output_file_size,
+                        FIXED_COLUMN_COUNT)
+from vcf_info_parser import InfoParser
+from vcf_summary import VCFSummary
 """
 Create a set of files from a VCF that can be loaded into a relational database
 and that are designed to be optimally queryable with SQL.
 TODO: 
 - QUAL and FILTER not yet processed. Header rows need to be handled better.
-- Separate class needed for the header
 """
 
 class VCFToFiles:
     """Decompose a VCF file to a set of files for database upload.
     """
-    def __init__(self, vcf_file_path, output_dir, column_separator='\t'):
+    def __init__(self, vcf_file_path, output_dir, column_separator='\t', workers=1,
+                 chunk_size=64 * 1024 * 1024, compact=False, summary=False):
         """Instantiate with a path to a readable VCF file, a directory path to where files
-        are written and an optional column separator with tab as default."""
+        are written and an optional column separator with tab as default.
+        The VCF can be plain text or gzip/bgzip compressed. Setting workers to more than 1
+        parses the VCF body in a process pool, in chunks of roughly chunk_size bytes each.
+        Set compact to write the files for the compact schema in compact_vcf_ddl.sql:
+        variants are numbered from 1 in file order and the INFO key-value and flag files
+        refer to them by that number and to INFO keys by the ids in an extra INFO keys file.
+        Compact output is only written serially.
+        Set summary to also gather a vcf_summary.VCFSummary of the rows, in the same parse of
+        the INFO column, and write it to a JSON summary file."""
         self.vcf_file_path = vcf_file_path
         self.output_dir = output_dir
         self.column_separator = column_separator
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.compact = compact
         assert os.path.isfile(vcf_file_path) and os.access(vcf_file_path, os.R_OK), \
             "File {} doesn't exist or isn't readable".format(vcf_file_path)
         self.vcf_basename = os.path.basename(vcf_file_path)
-        self.vcf_name_minus_ext = os.path.splitext(self.vcf_basename)[0]
+        self.vcf_name_minus_ext = strip_vcf_extension(self.vcf_basename)
+        self._info_parser = None
+        # Compact output state: INFO key -> id and the rowid of the last variant written
+        self.info_key_ids = None
+        self.last_variant_rowid = 0
+        self.summary = VCFSummary() if summary else None
+
+    @property
+    def info_parser(self):
+        """The InfoParser for the VCF's ##INFO definitions. It is built on first use, either from
+        the header lines passed to set_header_lines or from the VCFHeader cache."""
+        if self._info_parser is None:
+            self._info_parser = InfoParser.from_vcf_header(VCFHeader.load_or_read(self.vcf_file_path))
+        return self._info_parser
+
+    def set_header_lines(self, header_lines):
+        """Build the InfoParser from already read header lines if it isn't set yet."""
+        if self._info_parser is None:
+            self._info_parser = InfoParser.from_header_lines(header_lines)
+
+    def reset_compact_ids(self, info_key_ids=None, last_variant_rowid=0):
+        """Start numbering variants after last_variant_rowid and INFO keys from the given
+        INFO key -> id map or, by default, from 1 in ##INFO header order. Keys missing from
+        the header get the next free id when first seen."""
+        if info_key_ids is None:
+            info_key_ids = {info_id: info_key_id for info_key_id, info_id
+                            in enumerate(self.info_parser.info_ids, 1)}
+        self.info_key_ids = info_key_ids
+        self.last_variant_rowid = last_variant_rowid
+
+    def _get_info_key_id(self, info_key):
+        info_key_id = self.info_key_ids.get(info_key)
+        if info_key_id is None:
+            info_key_id = self.info_key_ids[info_key] = len(self.info_key_ids) + 1
+        return info_key_id
+
+    def write_info_keys_file(self):
+        """Write the INFO key id and INFO key of each key numbered so far, for compact output."""
+        with open(self._make_output_file_names_map()['info_keys'], 'wt') as fho:
+            for info_key, info_key_id in self.info_key_ids.items():
+                fho.write(self.column_separator.join([str(info_key_id), info_key]) + os.linesep)
 
     def write_header_file(self):
         """Write the header lines, that is, those beginning with ## to a given output file.
         TODO: May need more processing.
         """
-        output_file = os.path.join(self.output_dir, self.vcf_name_minus_ext + '_header.txt')
-        fho = open(output_file, 'wt')
-        with open(self.vcf_file_path) as fh:
-            for row in fh:
-                if row.startswith('#CHROM'): break
-                fho.write(row)
-        fho.close()
+        output_file = self._make_output_file_names_map()['header']
+        vcf_stream = VCFStream(self.vcf_file_path)
+        vcf_stream.add_sink(HeaderFileSink(output_file))
+        vcf_stream.run()
 
     def _make_output_file_names_map(self):
         """Return a dictionary mapping shorthand keys to full paths
@@ -44,6 +100,8 @@ class VCFToFiles:
             'variant_details': name_base + '_variant_details.txt',
             'info_keys_vals': name_base + '_info_keys_vals.txt',
             'info_flags': name_base + '_info_flags.txt',
+            'summary': name_base + '_summary.json',
+            'info_keys': name_base + '_info_keys.txt',
             'variant_qual_filter': name_base + '_variant_qual_filter.txt'}
         return output_file_names_map
 
@@ -54,25 +112,33 @@ class VCFToFiles:
         variant_detail_row = [row[i] for i in columns_to_keep]
         return self.column_separator.join(variant_detail_row) + os.linesep
 
+    def _format_info_keys_vals(self, variant_id, info_keys_vals):
+        """Return the multi-line INFO key-value output string for a variant ID and its
+        (key, value, datatype) tuples as returned by InfoParser.split."""
+        info_lines = [self.column_separator.join([variant_id, info_key, info_val, datatype])
+                        for info_key, info_val, datatype in info_keys_vals]
+        return os.linesep.join(info_lines) + os.linesep
+
+    def _format_info_flags(self, variant_id, info_flags):
+        """Return the multi-line INFO flag output string for a variant ID and its flags,
+        or an empty string if there are no flags."""
+        if info_flags:
+            info_flags_variants = [self.column_separator.join([variant_id, info_flag])
+                                    for info_flag in info_flags]
+            return os.linesep.join(info_flags_variants) + os.linesep
+        return ''
+
     def _make_info_keys_vals(self, row):
         """Given a VCF data row, split on ';' and extract the INFO column and variant ID.
         Return a multi-line string containing three columns representing the variant ID
-        and one column each for the INFO elements on each side of the = sign."""
+        and one column each for the INFO elements on each side of the = sign, plus a
+        fourth datatype column that is 'num' for numeric values of Integer and Float INFO
+        fields and 'str' otherwise."""
         info_column_index = 7
         variant_id_index = 2
         variant_id, info_value = row[variant_id_index], row[info_column_index]
-        info_pairs = [info_pair.split('=') for info_pair 
-                        in info_value.split(';') 
-                            if '=' in info_pair]
-        info_lines = []
-        for info_pair in info_pairs:
-            info_line_elements = [variant_id, info_pair[0], info_pair[1]]
-            if info_pair[1].replace('.', '').isdigit():
-                info_line_elements.append('num')
-            else:
-                info_line_elements.append('str') 
-            info_lines.append(self.column_separator.join(info_line_elements))
-        return os.linesep.join(info_lines) + os.linesep
+        info_keys_vals, _ = self.info_parser.split(info_value)
+        return self._format_info_keys_vals(variant_id, info_keys_vals)
     
     def _make_info_flags(self, row):
         """Given a VCF data row, split on ';' and extract the INFO column and variant ID.
@@ -84,41 +150,256 @@ class VCFToFiles:
         info_column_index = 7
         variant_id_index = 2
         variant_id, info_value = row[variant_id_index], row[info_column_index]
-        info_flags = [info_flag for info_flag in info_value.split(';') 
-                        if '=' not in info_flag and info_flag != '']
+        _, info_flags = self.info_parser.split(info_value)
+        return self._format_info_flags(variant_id, info_flags)
+
+    def _make_variant_record(self, row):
+        """Given a VCF data row, return a (variant_details, info_keys_vals, info_flags) tuple:
+        the chromosome, position, variant ID and ref and alt alleles; a list of
+        (variant ID, key, value, datatype) tuples; and a list of (variant ID, flag) tuples.
+        These are the rows of the output files as tuples, for loaders that skip the files.
+        For compact output the variant details start with the variant rowid and the other
+        tuples have the variant rowid and INFO key ids instead of the variant ID and keys."""
+        info_keys_vals, info_flags = self.info_parser.split(row[7])
+        if self.summary is not None:
+            self.summary.add(row[0], info_keys_vals, info_flags, self.info_parser.numeric_info_ids)
+        if self.compact:
+            return self._make_compact_variant_record(row, info_keys_vals, info_flags)
+        variant_id = row[2]
+        info_keys_vals = [(variant_id, info_key, info_val, datatype)
+                          for info_key, info_val, datatype in info_keys_vals]
+        info_flags = [(variant_id, info_flag) for info_flag in info_flags]
+        return tuple(row[:5]), info_keys_vals, info_flags
+
+    def _make_compact_variant_record(self, row, info_keys_vals, info_flags):
+        self.last_variant_rowid += 1
+        variant_rowid = self.last_variant_rowid
+        get_info_key_id = self._get_info_key_id
+        info_keys_vals = [(variant_rowid, get_info_key_id(info_key), info_val, datatype)
+                          for info_key, info_val, datatype in info_keys_vals]
+        info_flags = [(variant_rowid, get_info_key_id(info_flag)) for info_flag in info_flags]
+        return (variant_rowid,) + tuple(row[:5]), info_keys_vals, info_flags
+
+    def iter_variant_records(self, regions=None):
+        """Yield a variant record tuple, see _make_variant_record, for each VCF data row."""
+        if self.compact:
+            self.reset_compact_ids()
+        for row in iter_body_rows(self.vcf_file_path, regions):
+            yield self._make_variant_record(row)
+
+    def _write_row(self, row, fh_vd, fh_ikv, fh_if, split_info=None):
+        """Write the output lines for a VCF data row to the variant details,
+        INFO key-value and INFO flag file handles. split_info, if given, is used instead of
+        the InfoParser split method so that instrumented runs can time it."""
+        info_keys_vals, info_flags = (split_info or self.info_parser.split)(row[7])
+        if self.summary is not None:
+            self.summary.add(row[0], info_keys_vals, info_flags, self.info_parser.numeric_info_ids)
+        if self.compact:
+            self._write_compact_row(row, info_keys_vals, info_flags, fh_vd, fh_ikv, fh_if)
+            return
+        vd_row = self._make_variant_details(row)
+        fh_vd.write(vd_row)
+        variant_id = row[2]
+        ikv_rows = self._format_info_keys_vals(variant_id, info_keys_vals)
+        fh_ikv.write(ikv_rows)
+        if_row = self._format_info_flags(variant_id, info_flags)
+        # Do not print to the info flags file if there are no flags
+        if if_row:
+            fh_if.write(if_row)
+
+    def _write_compact_row(self, row, info_keys_vals, info_flags, fh_vd, fh_ikv, fh_if):
+        """Write the compact output lines for a VCF data row and its split INFO column."""
+        self.last_variant_rowid += 1
+        variant_rowid = str(self.last_variant_rowid)
+        fh_vd.write(self.column_separator.join([variant_rowid] + row[:5]) + os.linesep)
+        get_info_key_id = self._get_info_key_id
+        if info_keys_vals:
+            info_keys_vals = [(str(get_info_key_id(info_key)), info_val, datatype)
+                              for info_key, info_val, datatype in info_keys_vals]
+            fh_ikv.write(self._format_info_keys_vals(variant_rowid, info_keys_vals))
         if info_flags:
-            info_flags_variants = [self.column_separator.join([variant_id, info_flag])
-                                    for info_flag in info_flags]
-            return os.linesep.join(info_flags_variants) + os.linesep
-        return ''
+            info_flags = [str(get_info_key_id(info_flag)) for info_flag in info_flags]
+            fh_if.write(self._format_info_flags(variant_rowid, info_flags))
+
+    def _write_rows(self, rows, fh_vd, fh_ikv, fh_if):
+        """Write the output lines for each of the given VCF data rows."""
+        for row in rows:
+            self._write_row(row, fh_vd, fh_ikv, fh_if)
+
+    def _get_body_offset(self):
+        """Return the byte offset of the first data row, that is, the row after #CHROM."""
+        return VCFHeader.load_or_read(self.vcf_file_path).data_offset
+
+    def _make_chunk_offsets(self):
+        """Split the VCF body into byte ranges of about chunk_size bytes.
+        Return a list of (start, end) offset tuples where every range ends on a line boundary."""
+        file_size = os.path.getsize(self.vcf_file_path)
+        chunk_offsets = []
+        start = self._get_body_offset()
+        with open(self.vcf_file_path, 'rb') as fh:
+            while start < file_size:
+                fh.seek(min(start + self.chunk_size, file_size))
+                fh.readline()
+                end = min(fh.tell(), file_size)
+                chunk_offsets.append((start, end))
+                start = end
+        return chunk_offsets
+
+    def _iter_timed_results(self, results, chunk_offsets, stats):
+        """Yield the process pool results, counting rows and bytes, timing the wait for each
+        one as the read stage, which then includes the parsing done by the workers, and the
+        time until the next one is asked for as the write stage."""
+        results = iter(results)
+        for start, end in chunk_offsets:
+            start_time = time.perf_counter()
+            result = next(results)
+            read_end_time = time.perf_counter()
+            stats.add('read', read_end_time - start_time)
+            yield result
+            stats.add('write', time.perf_counter() - read_end_time)
+            stats.update(result[0].count(os.linesep), end - start)
+
+    def _write_variant_rows_in_parallel(self, fh_vd, fh_ikv, fh_if, stats=None):
+        """Parse the VCF body chunks in a process pool and write the results
+        to the output file handles in input order, merging the chunk summaries if required."""
+        # Build the INFO parser once here so it is passed to the workers with self
+        self.info_parser
+        chunk_offsets = self._make_chunk_offsets()
+        chunks = [(self, start, end) for start, end in chunk_offsets]
+        with multiprocessing.Pool(self.workers) as pool:
+            results = pool.imap(_convert_chunk, chunks)
+            if stats is not None:
+                stats.start(sum(end - start for start, end in chunk_offsets))
+                results = self._iter_timed_results(results, chunk_offsets, stats)
+            for vd_rows, ikv_rows, if_rows, chunk_summary in results:
+                fh_vd.write(vd_rows)
+                fh_ikv.write(ikv_rows)
+                fh_if.write(if_rows)
+                if chunk_summary is not None:
+                    self.summary.merge(chunk_summary)
+        if stats is not None:
+            stats.stop()
 
-    def write_variant_rows_to_files(self):
+    def write_variant_rows_to_files(self, regions=None, write_header=False, checkpoint_path=None,
+                                    stats=None):
         """This is the method to be called by clients to generate the output files from the input VCF.
         Reads the VCF file and uses other methods to extract and format the information
         that it then writes to a set of files.
-        TODO: Re-factor to remove the file opening and header line writing to a new method."""
-        output_file_names_map = self._make_output_file_names_map()
-        fh_vd = open(output_file_names_map['variant_details'], 'wt')
-        fh_ikv = open(output_file_names_map['info_keys_vals'], 'wt')
-        fh_if = open(output_file_names_map['info_flags'], 'wt')
-        row_start = False
-        with open(self.vcf_file_path) as fh:
-            csv_reader = csv.reader(fh, delimiter='\t')
-            for row in csv_reader:
-                if row_start:
-                    vd_row = self._make_variant_details(row)
-                    fh_vd.write(vd_row)
-                    ikv_rows = self._make_info_keys_vals(row)
-                    fh_ikv.write(ikv_rows)
-                    if_row = self._make_info_flags(row)
-                    # Do not print to the info flags file if there are no flags
-                    if if_row:
-                        fh_if.write(if_row)
-                if row[0].startswith('#CHROM'):
-                    row_start = True
-        fh_vd.close()
-        fh_ikv.close()
-        fh_if.close()
+        An optional list of regions such as ["chr1:1-5000000"] restricts the output to the
+        variants overlapping them; the VCF must then be position-sorted and either uncompressed
+        or bgzip compressed. Regions are always read serially.
+        Set write_header to also write the header file in the same read of the VCF.
+        To combine these files with other outputs in one read, add a VariantFilesSink
+        to a VCFStream instead.
+        With a checkpoint_path the serial run records a checkpoint there periodically and
+        a re-run of an interrupted job continues from the last checkpoint.
+        Pass a vcf_profile.PipelineStats as stats to collect stage timings and progress. With
+        workers the read stage covers the parsing in the pool and there is no INFO parse or
+        format time."""
+        use_workers = self.workers > 1 and not regions
+        if use_workers and checkpoint_path:
+            raise ValueError('Checkpointing is not supported with parallel parsing')
+        if use_workers and self.compact:
+            raise ValueError('Compact output is not supported with parallel parsing')
+        if use_workers and get_compression(self.vcf_file_path) != 'none':
+            raise ValueError('Parallel parsing requires an uncompressed VCF: {}'.format(self.vcf_file_path))
+        if use_workers:
+            if write_header:
+                self.write_header_file()
+            output_file_names_map = self._make_output_file_names_map()
+            fh_vd = open(output_file_names_map['variant_details'], 'wt')
+            fh_ikv = open(output_file_names_map['info_keys_vals'], 'wt')
+            fh_if = open(output_file_names_map['info_flags'], 'wt')
+            if self.summary is not None:
+                self.summary = VCFSummary()
+            self._write_variant_rows_in_parallel(fh_vd, fh_ikv, fh_if, stats)
+            fh_vd.close()
+            fh_ikv.close()
+            fh_if.close()
+            if self.summary is not None:
+                self.summary.save(output_file_names_map['summary'])
+        else:
+            vcf_stream = VCFStream(self.vcf_file_path, regions, checkpoint_path, stats=stats)
+            vcf_stream.add_sink(VariantFilesSink(self, write_header))
+            vcf_stream.run()
+
+class VariantFilesSink:
+    """VCFStream sink writing the VCFToFiles variant details, INFO key-value and INFO flag
+    files and, optionally, the header file. For compact output the INFO keys file, and with
+    summary set the summary file, are written when the sink is closed."""
+    needs_samples = False
+
+    def __init__(self, vcf_to_files, write_header=False):
+        self.vcf_to_files = vcf_to_files
+        self.write_header = write_header
+        self.output_file_names_map = vcf_to_files._make_output_file_names_map()
+
+    def open(self, header_lines):
+        self.resume(header_lines, None)
+
+    def resume(self, header_lines, state):
+        state = state or {}
+        self.vcf_to_files.set_header_lines(header_lines)
+        if self.vcf_to_files.compact:
+            self.vcf_to_files.reset_compact_ids(state.get('info_key_ids'),
+                                                state.get('last_variant_rowid', 0))
+        if self.vcf_to_files.summary is not None:
+            self.vcf_to_files.summary = VCFSummary.from_map(state['summary']) if 'summary' in state \
+                else VCFSummary()
+        if self.write_header:
+            header_sink = HeaderFileSink(self.output_file_names_map['header'])
+            header_sink.open(header_lines)
+        self.fh_vd = open_output_file(self.output_file_names_map['variant_details'],
+                                      state.get('variant_details'))
+        self.fh_ikv = open_output_file(self.output_file_names_map['info_keys_vals'],
+                                       state.get('info_keys_vals'))
+        self.fh_if = open_output_file(self.output_file_names_map['info_flags'],
+                                      state.get('info_flags'))
+        self.split_info = self.vcf_to_files.info_parser.split
+
+    def checkpoint(self):
+        state = {
+            'variant_details': get_output_file_size(self.fh_vd),
+            'info_keys_vals': get_output_file_size(self.fh_ikv),
+            'info_flags': get_output_file_size(self.fh_if)}
+        if self.vcf_to_files.compact:
+            state['info_key_ids'] = self.vcf_to_files.info_key_ids
+            state['last_variant_rowid'] = self.vcf_to_files.last_variant_rowid
+        if self.vcf_to_files.summary is not None:
+            state['summary'] = self.vcf_to_files.summary.to_map()
+        return state
+
+    def instrument(self, stats):
+        for file_handle_name in ('fh_vd', 'fh_ikv', 'fh_if'):
+            stats.time_output_file(self, file_handle_name)
+        stats.time_function(self, 'split_info', 'info_parse')
+
+    def write_row(self, row):
+        self.vcf_to_files._write_row(row, self.fh_vd, self.fh_ikv, self.fh_if, self.split_info)
+
+    def close(self):
+        self.fh_vd.close()
+        self.fh_ikv.close()
+        self.fh_if.close()
+        if self.vcf_to_files.compact:
+            self.vcf_to_files.write_info_keys_file()
+        if self.vcf_to_files.summary is not None:
+            self.vcf_to_files.summary.save(self.output_file_names_map['summary'])
+
+def _convert_chunk(chunk):
+    """Process pool task: parse the rows in one (vcf_to_files, start, end) byte range of
+    the VCF body and return the variant details, INFO key-value and INFO flag output
+    for the range as strings and the range's summary, or None if not required."""
+    vcf_to_files, start, end = chunk
+    if vcf_to_files.summary is not None:
+        vcf_to_files.summary = VCFSummary()
+    with open(vcf_to_files.vcf_file_path, 'rb') as fh:
+        fh.seek(start)
+        chunk_bytes = fh.read(end - start)
+    outputs = [io.StringIO() for _ in range(3)]
+    rows = iter_block_rows(io.BytesIO(chunk_bytes), FIXED_COLUMN_COUNT + 1)
+    vcf_to_files._write_rows(rows, *outputs)
+    return [output.getvalue() for output in outputs] + [vcf_to_files.summary]
 
 if __name__ == '__main__':
     from pprint import pprint
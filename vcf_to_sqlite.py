@@ -0,0 +1,173 @@
+import os
+import sqlite3
+from vcf_to_files import VCFToFiles
+from vcf_stream import VCFStream
+from vcf_summary import VCFSummary
+"""
+Load a VCF directly into an SQLite database with the schema in vcf_ddl.sql.
+This replaces the VCFToFiles -> files2sqlite.sh round-trip: parsed rows are streamed from
+VCFToFiles into the tables with batched inserts, INFO key-value pairs go straight to
+info_key_num_val or info_key_str_val, and the indexes in indexes.sql are created after the load.
+No intermediate files, load table or VACUUM are needed.
+With compact set, the compact schema in compact_vcf_ddl.sql and compact_indexes.sql is used:
+integer variant rowids and INFO key ids instead of repeated ID and key text. Its INFO
+tables are keyed on (variant_rowid, info_key_id), so a key repeated within one INFO column
+keeps its first value.
+With summary set, the vcf_summary statistics are gathered during the load and written to
+the summary tables in summary_ddl.sql.
+"""
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class VCFToSQLite:
+    """Bulk load the variant details, INFO key-value pairs and INFO flags of a VCF file
+    into a new SQLite database.
+    Instances are also VCFStream sinks so the load can share a read of the VCF with
+    other outputs.
+    """
+    needs_samples = False
+
+    def __init__(self, vcf_file_path, sqlite_db_path, batch_size=100000, compact=False,
+                 create_indexes=True, summary=False):
+        """Instantiate with a path to a readable VCF file, the path of the SQLite database
+        to create, an optional number of rows to insert per executemany call, whether to
+        use the compact schema, whether to create the indexes, which a staging database
+        that is only read through once doesn't need, and whether to write the summary tables.
+        Warning: an existing database at sqlite_db_path is removed when load is called!"""
+        self.vcf_file_path = vcf_file_path
+        self.sqlite_db_path = sqlite_db_path
+        self.batch_size = batch_size
+        self.compact = compact
+        self.create_indexes = create_indexes
+        self.vcf_to_files = VCFToFiles(vcf_file_path, os.path.dirname(sqlite_db_path),
+                                       compact=compact, summary=summary)
+        if compact:
+            self.ddl_file_path = os.path.join(SCRIPT_DIR, 'compact_vcf_ddl.sql')
+            self.index_file_path = os.path.join(SCRIPT_DIR, 'compact_indexes.sql')
+            self.insert_statements = {
+                'variant_detail': '''INSERT INTO variant(variant_rowid, chromosome, position,
+                                     variant_id, ref_allele, alt_allele) VALUES(?, ?, ?, ?, ?, ?)''',
+                'num': '''INSERT OR IGNORE INTO info_key_num_val(variant_rowid, info_key_id,
+                          info_num_val) VALUES(?, ?, ?)''',
+                'str': '''INSERT OR IGNORE INTO info_key_str_val(variant_rowid, info_key_id,
+                          info_str_val) VALUES(?, ?, ?)''',
+                'info_flag': 'INSERT OR IGNORE INTO info_flag(variant_rowid, info_key_id) VALUES(?, ?)'}
+        else:
+            self.ddl_file_path = os.path.join(SCRIPT_DIR, 'vcf_ddl.sql')
+            self.index_file_path = os.path.join(SCRIPT_DIR, 'indexes.sql')
+            self.insert_statements = {
+                'variant_detail': '''INSERT INTO variant_detail(chromosome, position, variant_id,
+                                     ref_allele, alt_allele) VALUES(?, ?, ?, ?, ?)''',
+                'num': 'INSERT INTO info_key_num_val(variant_id, info_key, info_num_val) VALUES(?, ?, ?)',
+                'str': 'INSERT INTO info_key_str_val(variant_id, info_key, info_str_val) VALUES(?, ?, ?)',
+                'info_flag': 'INSERT INTO info_flag(variant_id, info_flag) VALUES(?, ?)'}
+
+    def _read_sql_file(self, sql_file_path):
+        with open(sql_file_path) as fh:
+            return fh.read()
+
+    def _connect(self):
+        """Remove any existing database and return a connection to a new one set up
+        for bulk loading. A failed load leaves an unusable database that has to be
+        re-loaded, so journaling and syncing are turned off for the load."""
+        if os.path.exists(self.sqlite_db_path):
+            os.remove(self.sqlite_db_path)
+        conn = sqlite3.connect(self.sqlite_db_path, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA cache_size = -1000000')
+        return conn
+
+    def _insert_batches(self, conn, batches):
+        """Insert the rows accumulated in each batch list and empty the lists."""
+        for table_key, rows in batches.items():
+            if rows:
+                conn.executemany(self.insert_statements[table_key], rows)
+                rows.clear()
+
+    def open(self, header_lines):
+        """Create the database and start the load transaction."""
+        self.conn = self._connect()
+        self.conn.executescript(self._read_sql_file(self.ddl_file_path))
+        self.batches = {table_key: [] for table_key in self.insert_statements}
+        self.variant_count = 0
+        if self.compact:
+            self.vcf_to_files.set_header_lines(header_lines)
+            self.vcf_to_files.reset_compact_ids()
+        if self.vcf_to_files.summary is not None:
+            self.vcf_to_files.summary = VCFSummary()
+        self.conn.execute('BEGIN')
+
+    def write_row(self, row):
+        """Add the rows for a VCF data row to the batches, inserting them when full.
+        The split INFO column goes straight into the INFO batches and positions and numeric
+        values are converted here, so SQLite doesn't have to convert the text."""
+        vcf_to_files = self.vcf_to_files
+        batches = self.batches
+        info_keys_vals, info_flags = vcf_to_files.info_parser.split(row[7])
+        if vcf_to_files.summary is not None:
+            vcf_to_files.summary.add(row[0], info_keys_vals, info_flags,
+                                     vcf_to_files.info_parser.numeric_info_ids)
+        chrom, pos, variant_id, ref_allele, alt_allele = row[:5]
+        if self.compact:
+            vcf_to_files.last_variant_rowid += 1
+            variant_key = vcf_to_files.last_variant_rowid
+            batches['variant_detail'].append((variant_key, chrom, int(pos), variant_id,
+                                              ref_allele, alt_allele))
+            info_key_ids = vcf_to_files.info_key_ids
+            get_info_key_id = vcf_to_files._get_info_key_id
+        else:
+            variant_key = variant_id
+            batches['variant_detail'].append((chrom, int(pos), variant_id, ref_allele, alt_allele))
+        num_batch = batches['num']
+        str_batch = batches['str']
+        for info_key, info_val, datatype in info_keys_vals:
+            if self.compact:
+                info_key = info_key_ids.get(info_key) or get_info_key_id(info_key)
+            if datatype == 'num':
+                num_batch.append((variant_key, info_key, float(info_val)))
+            else:
+                str_batch.append((variant_key, info_key, info_val))
+        if info_flags:
+            if self.compact:
+                info_flags = [info_key_ids.get(info_flag) or get_info_key_id(info_flag)
+                              for info_flag in info_flags]
+            batches['info_flag'].extend([(variant_key, info_flag) for info_flag in info_flags])
+        self.variant_count += 1
+        if len(batches['variant_detail']) >= self.batch_size:
+            self._insert_batches(self.conn, batches)
+
+    def close(self):
+        """Insert the remaining rows and the summary, commit and create the indexes if required."""
+        self._insert_batches(self.conn, self.batches)
+        if self.compact:
+            self.conn.executemany('INSERT INTO info_key(info_key_id, info_key) VALUES(?, ?)',
+                                  [(info_key_id, info_key) for info_key, info_key_id
+                                   in self.vcf_to_files.info_key_ids.items()])
+        self.conn.execute('COMMIT')
+        if self.vcf_to_files.summary is not None:
+            self.vcf_to_files.summary.write_tables(self.conn)
+        if self.create_indexes:
+            self.conn.executescript(self._read_sql_file(self.index_file_path))
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.close()
+
+    def load(self, regions=None):
+        """Create the database, load all the VCF data rows, or just those overlapping the
+        optional regions, and create the indexes. Return the number of variants loaded."""
+        vcf_stream = VCFStream(self.vcf_file_path, regions)
+        vcf_stream.add_sink(self)
+        vcf_stream.run()
+        return self.variant_count
+
+if __name__ == '__main__':
+    import sys
+    vcf_file_path = sys.argv[1]
+    sqlite_db_path = sys.argv[2]
+    # Optional further arguments 'compact' for the compact schema and 'summary' for the
+    # summary tables
+    compact = 'compact' in sys.argv[3:]
+    summary = 'summary' in sys.argv[3:]
+    vcf_to_sqlite = VCFToSQLite(vcf_file_path, sqlite_db_path, compact=compact, summary=summary)
+    print(vcf_to_sqlite.load())